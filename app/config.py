@@ -29,11 +29,100 @@ class Settings(BaseSettings):
     # Chat history settings
     CHAT_HISTORY_MAX_TOKENS: int = 3000  # max tokens for conversation history (leaves room for system prompt + new message + response)
 
+    # Chat persistence: each turn is one transaction; with write-behind, turns are queued
+    # and a background writer commits up to CHAT_WRITE_BEHIND_MAX_BATCH of them at once
+    CHAT_WRITE_BEHIND_ENABLED: bool = False
+    CHAT_WRITE_BEHIND_MAX_PENDING: int = 1000
+    CHAT_WRITE_BEHIND_MAX_BATCH: int = 50
+
+    # Per-client session resolution cache (client_id -> user/session ids)
+    CLIENT_SESSION_CACHE_TTL_SECONDS: float = 300.0
+    CLIENT_SESSION_CACHE_MAX_ENTRIES: int = 10_000
+
+    # Rolling conversation summaries: once a session's unsummarized turns exceed the trigger,
+    # all but the newest CHAT_SUMMARY_KEEP_RECENT_TOKENS are folded into a stored summary
+    CHAT_SUMMARY_ENABLED: bool = True
+    CHAT_SUMMARY_MODEL: str = "gpt-4o-mini"
+    CHAT_SUMMARY_TRIGGER_TOKENS: int = 2000
+    CHAT_SUMMARY_KEEP_RECENT_TOKENS: int = 800
+    CHAT_SUMMARY_MAX_TOKENS: int = 300
+
     # OpenAI generation settings
     OPENAI_MODEL: str = "gpt-3.5-turbo"
     OPENAI_TEMPERATURE: float = 0.3
     OPENAI_MAX_TOKENS: int = 400
 
+    # OpenAI HTTP client settings (shared connection pool)
+    OPENAI_TIMEOUT_SECONDS: float = 30.0
+    OPENAI_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    OPENAI_MAX_RETRIES: int = 2  # SDK retries with exponential backoff on connection errors, 429 and 5xx
+    OPENAI_MAX_CONNECTIONS: int = 50
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+
+    # Completion resilience: each model gets LLM_DEADLINE_SECONDS (retries included), then the
+    # next model in LLM_FALLBACK_MODELS; messaging_config.server_error_message is the last resort
+    LLM_DEADLINE_SECONDS: float = 20.0
+    LLM_FALLBACK_MODELS: List[str] = Field(default_factory=lambda: ["gpt-4o-mini"])
+    LLM_HEDGE_ENABLED: bool = False  # race a second identical request once a call exceeds the p95 latency
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 1.0
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # completed calls needed before the p95 is trusted
+
+    # Document ingestion settings
+    PDF_PARALLEL_MIN_PAGES: int = 50  # PDFs with at least this many pages are extracted in a process pool
+    PDF_EXTRACT_WORKERS: int = 2
+    CHUNK_MAX_TOKENS: int = 500
+    CHUNK_OVERLAP_TOKENS: int = 0  # tokens repeated from the end of one chunk at the start of the next
+    EMBEDDING_BATCH_SIZE: int = 64  # chunks embedded and written per batch
+    INGESTION_MAX_WORKERS: int = 1  # concurrent background ingestion jobs (keeps CPU free for /chat)
+    INGESTION_MAX_PENDING: int = 20  # queued + running jobs before uploads are rejected
+
+    # Embedding backend: sentence-transformers (torch), fastembed, onnx or onnx-int8
+    EMBEDDING_BACKEND: str = "sentence-transformers"
+    EMBEDDING_MODEL_NAME: str = "all-MiniLM-L6-v2"
+    EMBEDDING_ONNX_MODEL_DIR: Optional[str] = None  # model.onnx + tokenizer.json, for the onnx backends
+
+    # Query embedding micro-batching
+    EMBEDDING_QUERY_BATCHING: bool = True
+    EMBEDDING_QUERY_MAX_BATCH: int = 32
+    EMBEDDING_QUERY_MAX_WAIT_MS: float = 5.0
+
+    # Direct FAQ answers (strict_faq mode only): reply with the stored answer and skip the LLM call
+    FAQ_DIRECT_ANSWER_ENABLED: bool = False
+    FAQ_DIRECT_ANSWER_MAX_DISTANCE: float = 0.05
+    FAQ_DIRECT_ANSWER_MIN_COVERAGE: float = 0.6  # share of the FAQ question's terms present in the query
+    FAQ_DIRECT_ANSWER_TEMPLATE: str = "{answer}"  # may also use {question}
+
+    # Model routing: trivial and FAQ-exact turns use a faster model than messaging_config.ai_model
+    MODEL_ROUTING_ENABLED: bool = True
+    MODEL_ROUTER_FAST_MODEL: str = "gpt-4o-mini"
+    MODEL_ROUTER_FAQ_MAX_DISTANCE: float = 0.05  # best FAQ hit at or below this distance counts as an exact match
+
+    # Retrieved context packing: snippets are added by relevance until the token budget is used
+    RAG_CONTEXT_MAX_TOKENS: int = 2500  # cap even when the model window would allow more
+    RAG_CONTEXT_MAX_RESULTS: int = 12
+    RAG_CONTEXT_MIN_SNIPPET_TOKENS: int = 50  # smaller leftovers are dropped rather than truncated
+    RAG_CONTEXT_SAFETY_TOKENS: int = 200  # margin for the template text and tokenizer differences
+
+    # Threads for overlapping the FAQ/KB lookups of a chat request
+    RETRIEVAL_MAX_WORKERS: int = 8
+
+    # FAQ semantic matching: max cosine distance for an FAQ vector hit
+    FAQ_SEMANTIC_MAX_DISTANCE: float = 0.5
+
+    # Embedding cache (persisted next to the Chroma store)
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = "./chroma_db/embedding_cache.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 200_000
+
+    # Semantic response cache for history-less first messages
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_SIMILARITY: float = 0.95  # min cosine similarity between query embeddings for a hit
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_TTL_SECONDS: float = 3600.0
+    # Used only to estimate the cost saved by cache hits (USD per 1K tokens)
+    LLM_PROMPT_COST_PER_1K: float = 0.0025
+    LLM_COMPLETION_COST_PER_1K: float = 0.01
+
     CORS_ORIGINS: List[str] = Field(default_factory=list)
     model_config = SettingsConfigDict( env_file=str(BASE_DIR / ".env"), case_sensitive=False)
     
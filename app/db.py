@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 from config import settings
@@ -9,10 +11,83 @@ SessionLocal=sessionmaker(autocommit=False,bind=engine,autoflush=False,future=Tr
 class Base(DeclarativeBase):
     pass
 
+def db_stats(session) -> dict:
+    """Commits, statements and DB seconds (statement execution plus commit round trips) of an ORM session.
+    uncommitted_writes counts INSERT/UPDATE/DELETE statements since the last commit or rollback."""
+    return session.info.setdefault("db_stats", {"commits": 0, "statements": 0, "db_seconds": 0.0, "uncommitted_writes": 0})
+
+@event.listens_for(SessionLocal, "after_begin")
+def _bind_db_stats(session, transaction, connection):
+    connection.info["session_db_stats"] = db_stats(session)
+    # The pooled connection's info dict outlives the checkout; keep it to unbind later
+    session.info["_db_stats_connection_info"] = connection.info
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _unbind_db_stats(session, transaction):
+    if transaction.parent is None:
+        connection_info = session.info.pop("_db_stats_connection_info", None)
+        if connection_info is not None:
+            connection_info.pop("session_db_stats", None)
+
+@event.listens_for(SessionLocal, "before_commit")
+def _start_commit_timer(session):
+    db_stats(session)["_commit_started"] = time.perf_counter()
+
+@event.listens_for(SessionLocal, "after_commit")
+def _stop_commit_timer(session):
+    stats = db_stats(session)
+    started = stats.pop("_commit_started", None)
+    if started is not None:
+        stats["db_seconds"] += time.perf_counter() - started
+
+@event.listens_for(engine, "commit")
+def _count_commit(conn):
+    # Only real COMMITs; releasing a savepoint does not count
+    stats = conn.info.get("session_db_stats")
+    if stats is not None:
+        stats["commits"] += 1
+        stats["uncommitted_writes"] = 0
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _reset_uncommitted(session):
+    stats = db_stats(session)
+    stats.pop("_commit_started", None)
+    stats["uncommitted_writes"] = 0
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info["_statement_started"] = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+def _stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("_statement_started", None)
+    stats = conn.info.get("session_db_stats")
+    if stats is None or started is None:
+        return
+    stats["statements"] += 1
+    if context is not None and (context.isinsert or context.isupdate or context.isdelete):
+        stats["uncommitted_writes"] += 1
+    # Statements flushed inside a commit are already part of the commit's time
+    if "_commit_started" not in stats:
+        stats["db_seconds"] += time.perf_counter() - started
+
 def get_db():
  try:
     db=SessionLocal()
     yield db
  finally:
      db.close()
-     
\ No newline at end of file
+     
+
+# Columns added after the initial release. create_all() only creates missing
+# tables, so existing databases get these additive, idempotent upgrades instead.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_content_hash ON document_chunks (content_hash)",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS token_count INTEGER",
+]
+
+def apply_schema_upgrades():
+    with engine.begin() as conn:
+        for stmt in SCHEMA_UPGRADES:
+            conn.execute(text(stmt))
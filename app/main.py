@@ -1,48 +1,102 @@
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Header, Response, Request
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
+from sqlalchemy import select, update
 from sqlalchemy.sql import func
 from typing import List
-from openai import OpenAI
 from jose import jwt, JWTError
 from datetime import datetime, timedelta, timezone
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from config import settings
-from db import get_db, Base, engine
+from db import get_db, Base, engine, SessionLocal, apply_schema_upgrades, db_stats
 from models import Prompt, KnowledgeDocument, Message, User, Session as ChatSession, Lead, WidgetConfig, FAQ, DocumentVisibility, MessagingConfig, StarterQuestions, FormResponse, Form
-from schemas import ChatIn, ChatResponseOut, SystemPromptIn, SystemPromptOut, DocumentUploadOut, DocumentListOut, DocumentDeleteOut, ChatMessageOut, ChatDetailOut, UserOut, UserDetailOut, ChatOut
+from schemas import ChatIn, ChatResponseOut, SystemPromptIn, SystemPromptOut, DocumentUploadOut, IngestionJobOut, DocumentListOut, DocumentDeleteOut, ChatMessageOut, ChatDetailOut, UserOut, UserDetailOut, ChatOut
 from schemas import LeadIn, LeadOut, WidgetConfigOut, WidgetConfigIn
 from schemas import FormField, BotConfigOut, BotConfigIn, MessagingConfigOut, MessagingConfigIn, StarterQuestionsOut, StarterQuestionsIn
 from schemas import LoginIn, LoginOut, FAQIn
-from services.rag_service import RAGService
-from utils.token_counter import trim_history_to_token_budget
+from services.rag_service import SOURCE_SERVER_ERROR, RAGService
+from services.ingestion_jobs import IngestionJobQueue
+from services.prompt_cache import DEFAULT_MESSAGING_CONFIG, PromptAssembly, PromptCache
+from services.client_session_cache import ClientSessionCache
+from services.chat_persistence import ChatTurn, ChatTurnWriter
+from services.conversation_summarizer import ConversationSummarizer, get_summary, summary_message
+from utils.token_counter import MESSAGE_OVERHEAD_TOKENS, count_tokens, count_tokens_batch
+import anyio
 import os
 import shutil
 from pathlib import Path
 import csv
+import json
+import threading
 from io import StringIO
 
 app = FastAPI()
 limiter = Limiter(key_func=get_remote_address)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
 rag_service = RAGService()
+ingestion_queue = IngestionJobQueue(
+    rag_service,
+    max_workers=settings.INGESTION_MAX_WORKERS,
+    max_pending=settings.INGESTION_MAX_PENDING,
+)
+# client_id -> (user_id, open session_id) for the chat hot path
+client_session_cache = ClientSessionCache(
+    ttl_seconds=settings.CLIENT_SESSION_CACHE_TTL_SECONDS,
+    max_entries=settings.CLIENT_SESSION_CACHE_MAX_ENTRIES,
+)
+# Rolling summaries of long sessions, written in the background
+summarizer = None
+if settings.CHAT_SUMMARY_ENABLED:
+    summarizer = ConversationSummarizer(
+        rag_service.llm,
+        model=settings.CHAT_SUMMARY_MODEL,
+        trigger_tokens=settings.CHAT_SUMMARY_TRIGGER_TOKENS,
+        keep_recent_tokens=settings.CHAT_SUMMARY_KEEP_RECENT_TOKENS,
+        max_summary_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+        deadline=settings.LLM_DEADLINE_SECONDS,
+    )
+# Chat turn persistence (one transaction per turn, or batched write-behind)
+chat_writer = ChatTurnWriter(
+    write_behind=settings.CHAT_WRITE_BEHIND_ENABLED,
+    max_pending=settings.CHAT_WRITE_BEHIND_MAX_PENDING,
+    max_batch=settings.CHAT_WRITE_BEHIND_MAX_BATCH,
+    # _schedule_summaries is defined with the chat endpoints below
+    on_written=lambda turns: _schedule_summaries(turns),
+)
 
 @app.on_event("startup")
 async def startup_event():
     """Create database tables on startup"""
     try:
         Base.metadata.create_all(bind=engine)
+        apply_schema_upgrades()
         print("✅ Database tables created successfully")
+        # Existing messages get their token_count off the startup path
+        threading.Thread(target=_backfill_message_token_counts, name="token-count-backfill", daemon=True).start()
+        # FAQ vectors are embedded off the startup and request paths
+        threading.Thread(target=_sync_faq_vectors, name="faq-vector-sync", daemon=True).start()
     except Exception as e:
         print(f"❌ Error creating database tables: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    ingestion_queue.shutdown()
+    chat_writer.shutdown()
+    if summarizer is not None:
+        summarizer.shutdown()
+    if rag_service.query_batcher is not None:
+        rag_service.query_batcher.shutdown()
+    rag_service.retrieval_pool.shutdown(wait=False)
+    rag_service.llm.close()
+    await rag_service.llm.aclose()
+
 # CORS: allow configured origins; if none provided, allow all (no credentials)
 origins = settings.cors_origins_parsed or ["*"]
 app.add_middleware(
@@ -167,7 +221,25 @@ def _get_client_session(db: Session, client_id: str) -> ChatSession | None:
 
 def _get_or_create_client_session(db: Session, client_id: str, name: str | None = None, email: str | None = None, ip_address: str | None = None) -> ChatSession:
     """Return a per-client session keyed by a stable client_id (from header or body).
-    Only creates session when there's actual user interaction (form submit or chat message)."""
+    Only creates session when there's actual user interaction (form submit or chat message).
+    Steady-state calls are served from client_session_cache: one primary-key load of the
+    session, and the user row is only written here when the IP actually changed. Changes are
+    flushed, not committed; the caller's commit persists them. For chat turns, last_activity
+    is refreshed by write_turns in the turn's own transaction."""
+    cached = client_session_cache.get(client_id)
+    if cached is not None and not (name and not cached.has_name) and not (email and not cached.has_email):
+        sess = db.get(ChatSession, cached.session_id)
+        if sess is not None and sess.status == "open":
+            if ip_address and ip_address != cached.ip_address:
+                db.execute(
+                    update(User)
+                    .where(User.id == cached.user_id)
+                    .values(ip_address=ip_address, last_activity=func.now())
+                )
+                cached.ip_address = ip_address
+            return sess
+        client_session_cache.invalidate(client_id)
+
     # Each unique client_id maps to one User and one open Session
     user = db.query(User).filter(User.external_user_id == client_id).first()
     if not user:
@@ -178,10 +250,9 @@ def _get_or_create_client_session(db: Session, client_id: str, name: str | None
             ip_address=ip_address
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        db.flush()
     else:
-        # Update user info if provided
+        # Update user info if provided and actually different
         updated = False
         if name and not user.name:
             user.name = name
@@ -189,13 +260,14 @@ def _get_or_create_client_session(db: Session, client_id: str, name: str | None
         if email and not user.email:
             user.email = email
             updated = True
-        if ip_address:
+        if ip_address and user.ip_address != ip_address:
             user.ip_address = ip_address
             updated = True
         if updated:
             user.last_activity = func.now()
             db.add(user)
-            db.commit()
+            # Flush so the caller sees the write (autoflush is off) and commits it
+            db.flush()
 
     sess = (
         db.query(ChatSession)
@@ -206,8 +278,10 @@ def _get_or_create_client_session(db: Session, client_id: str, name: str | None
     if not sess:
         sess = ChatSession(user_id=user.id, session_metadata={"client_id": client_id})
         db.add(sess)
-        db.commit()
-        db.refresh(sess)
+        db.flush()
+    client_session_cache.put(
+        client_id, user.id, sess.id, user.ip_address, has_name=bool(user.name), has_email=bool(user.email)
+    )
     return sess
 
 def _get_or_create_user_by_client_id(db: Session, client_id: str) -> User:
@@ -219,54 +293,80 @@ def _get_or_create_user_by_client_id(db: Session, client_id: str) -> User:
         db.refresh(user)
     return user
 
-def _fetch_history_by_token_budget(db: Session, session_id: int) -> list[dict]:
+def _message_token_count(content: str) -> int:
+    """Token count stored on Message.token_count when the message is written."""
+    return count_tokens(content or "", settings.OPENAI_MODEL)
+
+def _fetch_history_by_token_budget(db: Session, session_id: int, after_message_id: int = 0) -> tuple[list[dict], int]:
     """Fetch chat history strictly by token budget (no arbitrary message limit).
-    We page messages in chunks from newest to oldest until the budget is filled.
+    One query: a running sum of the stored token counts, newest first, selects the
+    most recent messages that fit CHAT_HISTORY_MAX_TOKENS; nothing is re-tokenized.
+    Rows not backfilled yet are estimated from their length.
+    Messages up to after_message_id (already folded into the session summary) are skipped.
+    Returns (messages, tokens) where tokens includes the per-message overhead.
     """
-    # Hard guard against runaway DB scans; can be tuned
-    page_size = 100
-    offset = 0
-    collected: list[Message] = []
-
-    # Keep pulling pages until adding another page would exceed token budget after trimming
-    while True:
-        page = (
-            db.query(Message)
-            .filter(Message.session_id == session_id)
-            .order_by(Message.id.desc())
-            .offset(offset)
-            .limit(page_size)
-            .all()
+    tokens = func.coalesce(Message.token_count, func.length(Message.content) / 4 + 1) + MESSAGE_OVERHEAD_TOKENS
+    window = (
+        select(
+            Message.id.label("id"),
+            func.sum(tokens).over(order_by=Message.id.desc()).label("running_tokens"),
         )
-        if not page:
-            break
-
-        collected.extend(page)
-        # Try trimming with what we have so far; if it already meets budget, we can stop
-        test_msgs = [
-            {"role": m.role, "content": m.content}
-            for m in reversed(collected)
-            if m.role in ("user", "assistant")
-        ]
-        trimmed = trim_history_to_token_budget(
-            test_msgs,
-            settings.CHAT_HISTORY_MAX_TOKENS,
-            settings.OPENAI_MODEL,
+        .where(
+            Message.session_id == session_id,
+            Message.id > after_message_id,
+            Message.role.in_(("user", "assistant")),
         )
-        # If trimming didn't grow with this page (i.e., budget reached), stop
-        if len(trimmed) < len(test_msgs):
-            break
-        offset += page_size
-
-    # Final trim on the aggregated set
-    final_msgs = [
-        {"role": m.role, "content": m.content}
-        for m in reversed(collected)
-        if m.role in ("user", "assistant")
-    ]
-    return trim_history_to_token_budget(
-        final_msgs, settings.CHAT_HISTORY_MAX_TOKENS, settings.OPENAI_MODEL
+        .subquery()
     )
+    rows = db.execute(
+        select(Message.role, Message.content, window.c.running_tokens)
+        .join(window, window.c.id == Message.id)
+        .where(window.c.running_tokens <= settings.CHAT_HISTORY_MAX_TOKENS)
+        .order_by(Message.id.asc())
+    ).all()
+    # The running sum is taken newest first, so the oldest kept row holds the total
+    tokens = int(rows[0].running_tokens) if rows else 0
+    return [{"role": role, "content": content} for role, content, _ in rows], tokens
+
+def _sync_faq_vectors() -> None:
+    db = SessionLocal()
+    try:
+        rag_service.sync_faq_vectors(db)
+    except Exception as e:
+        db.rollback()
+        print(f"Error syncing FAQ vectors: {e}")
+    finally:
+        db.close()
+
+def _backfill_message_token_counts(batch_size: int = 1000) -> None:
+    """Fill Message.token_count for rows written before the column existed."""
+    db = SessionLocal()
+    filled = 0
+    try:
+        while True:
+            rows = (
+                db.query(Message.id, Message.content)
+                .filter(Message.token_count.is_(None))
+                .order_by(Message.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            counts = count_tokens_batch([content for _, content in rows], settings.OPENAI_MODEL)
+            db.execute(
+                update(Message),
+                [{"id": msg_id, "token_count": n} for (msg_id, _), n in zip(rows, counts)],
+            )
+            db.commit()
+            filled += len(rows)
+        if filled:
+            print(f"Backfilled token_count for {filled} messages")
+    except Exception as e:
+        db.rollback()
+        print(f"Error backfilling message token counts: {e}")
+    finally:
+        db.close()
 
 
 @app.get("/messages")
@@ -279,7 +379,7 @@ async def get_messages(x_client_id: str | None = Header(default=None), db: Sessi
         sess = _get_client_session(db, client_id)
         if not sess:
             return {"messages": []}
-        trimmed = _fetch_history_by_token_budget(db, sess.id)
+        trimmed, _ = _fetch_history_by_token_budget(db, sess.id)
         # Return trimmed messages in chronological order
         return {"messages": trimmed}
     except Exception as e:
@@ -287,6 +387,107 @@ async def get_messages(x_client_id: str | None = Header(default=None), db: Sessi
 
 # Removed multi-session management endpoints in single-session mode
 
+def _client_ip(x_forwarded_for: str | None, x_real_ip: str | None) -> str | None:
+    """Extract the caller IP from proxy headers."""
+    if x_real_ip:
+        return x_real_ip
+    if x_forwarded_for:
+        # X-Forwarded-For can contain multiple IPs, take the first one
+        return x_forwarded_for.split(',')[0].strip()
+    return None
+
+def _load_prompt_settings(db: Session) -> tuple[str, dict]:
+    """Current system prompt and messaging config, as used to build the cached PromptAssembly."""
+    messaging_cfg = _get_or_create_messaging_config(db)
+    messaging_config = {
+        'ai_model': messaging_cfg.ai_model,
+        'conversational': messaging_cfg.conversational,
+        'strict_faq': messaging_cfg.strict_faq,
+        'response_length': messaging_cfg.response_length,
+        'suggest_followups': messaging_cfg.suggest_followups,
+        'welcome_message': messaging_cfg.welcome_message,
+        'server_error_message': messaging_cfg.server_error_message
+    }
+    return get_current_system_prompt(db), messaging_config
+
+# Built system prompt prefix; invalidated by the system prompt and messaging config endpoints
+prompt_cache = PromptCache(_load_prompt_settings, rag_service._token_len)
+
+def _invalidate_prompt_caches() -> None:
+    prompt_cache.invalidate()
+    rag_service.invalidate_response_cache()
+
+def _prepare_chat_turn(db: Session, chat_data: ChatIn, x_client_id: str | None, ip_address: str | None) -> tuple[ChatTurn, list[dict], int, PromptAssembly]:
+    """Resolve the caller's session and load history.
+    Returns (turn, history, history_tokens, prompt) for the generation step; history_tokens
+    comes from the stored per-message counts so generation never re-tokenizes old turns. Nothing of the turn itself is
+    written yet: the user message, reply, session timestamps and lead go out together in
+    _persist_chat_turn. The resolve transaction is ended here so no pooled connection is
+    held during generation; it is only committed when resolving created or changed rows.
+    """
+    prompt = prompt_cache.get(db)
+
+    # Build OpenAI-formatted history for the caller's isolated session
+    client_id = (chat_data.client_id or x_client_id or "anonymous").strip() or "anonymous"
+    sess = _get_or_create_client_session(
+        db, 
+        client_id, 
+        name=chat_data.name, 
+        email=chat_data.email, 
+        ip_address=ip_address
+    )
+    # A previous turn of this session may still be in the write-behind queue
+    chat_writer.wait_for_session(sess.id)
+    # raw_history is already token-budgeted by _fetch_history_by_token_budget.
+    # Do NOT re-trim with the system prompt included — the system prompt alone
+    # can exceed CHAT_HISTORY_MAX_TOKENS and would silently drop all history.
+    # Turns already folded into the rolling summary are sent as one summary block.
+    summary = get_summary(sess) if summarizer is not None else None
+    if summary:
+        recent, history_tokens = _fetch_history_by_token_budget(
+            db, sess.id, after_message_id=summary["through_message_id"]
+        )
+        summary_msg = summary_message(summary)
+        history = [summary_msg] + recent
+        history_tokens += _message_token_count(summary_msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+    else:
+        history, history_tokens = _fetch_history_by_token_budget(db, sess.id)
+
+    # Set session title from first user message if not already set
+    title = None
+    if not sess.title:
+        title = chat_data.message[:50] + "..." if len(chat_data.message) > 50 else chat_data.message
+    # If name/email provided in this request, the lead is upserted with the turn
+    lead_name = chat_data.name.strip() if chat_data.name and chat_data.name.strip() else None
+    lead_email = str(chat_data.email) if chat_data.email else None
+    turn = ChatTurn(
+        sess.id, sess.user_id, client_id, chat_data.message, _message_token_count(chat_data.message),
+        title=title, lead_name=lead_name, lead_email=lead_email,
+    )
+
+    if db.new or db.dirty or db_stats(db)["uncommitted_writes"]:
+        db.commit()
+    else:
+        db.rollback()
+    return turn, history, history_tokens, prompt
+
+def _persist_chat_turn(db: Session, turn: ChatTurn, reply: str | None) -> None:
+    """User message, reply (if any), session timestamps and lead in one transaction,
+    or queued for the write-behind writer."""
+    if reply is not None:
+        turn.set_reply(reply, _message_token_count(reply))
+    chat_writer.submit(db, turn)
+
+def _schedule_summaries(turns: list[ChatTurn]) -> None:
+    if summarizer is None:
+        return
+    for session_id in {turn.session_id for turn in turns if turn.reply is not None}:
+        summarizer.schedule(session_id)
+
+def _record_chat_db_stats(*sessions: Session) -> None:
+    stats = [db_stats(s) for s in sessions]
+    chat_writer.record_chat(sum(s["commits"] for s in stats), sum(s["db_seconds"] for s in stats))
+
 @app.post("/chat", response_model=ChatResponseOut)
 @limiter.limit("30/minute")
 async def chat(request: Request, chat_data: ChatIn, x_client_id: str | None = Header(default=None), x_forwarded_for: str | None = Header(default=None), x_real_ip: str | None = Header(default=None), db: Session = Depends(get_db)):
@@ -295,104 +496,148 @@ async def chat(request: Request, chat_data: ChatIn, x_client_id: str | None = He
     - Persists the new user message and the assistant reply
     - Passes history to the RAG service for context
     """
+    # Blocking work (SQLAlchemy, embedding, Chroma) runs in the threadpool and the
+    # completion is awaited, so the event loop keeps serving other requests
+    turn = None
+    saved = False
     try:
-        system_prompt = get_current_system_prompt(db)
-
-        # Extract IP address from headers
-        ip_address = None
-        if x_real_ip:
-            ip_address = x_real_ip
-        elif x_forwarded_for:
-            # X-Forwarded-For can contain multiple IPs, take the first one
-            ip_address = x_forwarded_for.split(',')[0].strip()
+        turn, history, history_tokens, prompt = await run_in_threadpool(
+            _prepare_chat_turn, db, chat_data, x_client_id, _client_ip(x_forwarded_for, x_real_ip)
+        )
 
-        # Build OpenAI-formatted history for the caller's isolated session
-        client_id = (chat_data.client_id or x_client_id or "anonymous").strip() or "anonymous"
-        sess = _get_or_create_client_session(
-            db, 
-            client_id, 
-            name=chat_data.name, 
-            email=chat_data.email, 
-            ip_address=ip_address
+        # Generate response with token-budgeted history and messaging config
+        reply, used_kb, source = await rag_service.agenerate_rag_response(
+            chat_data.message, prompt, db, history=history, history_tokens=history_tokens
         )
-        # raw_history is already token-budgeted by _fetch_history_by_token_budget.
-        # Do NOT re-trim with the system prompt included — the system prompt alone
-        # can exceed CHAT_HISTORY_MAX_TOKENS and would silently drop all history.
-        history = _fetch_history_by_token_budget(db, sess.id)
 
-        # If name/email provided in this request, upsert lead
-        if (chat_data.name and chat_data.name.strip()) or chat_data.email:
-            try:
-                # Ensure user exists
-                _user = _get_or_create_user_by_client_id(db, client_id)
-                existing = (
-                    db.query(Lead)
-                    .filter(Lead.client_id == client_id)
-                    .order_by(Lead.id.desc())
-                    .first()
-                )
-                if existing:
-                    if chat_data.name and chat_data.name.strip():
-                        existing.name = chat_data.name.strip()
-                    if chat_data.email:
-                        existing.email = str(chat_data.email)
-                    db.add(existing)
-                    db.commit()
-                else:
-                    lead = Lead(user_id=_user.id, client_id=client_id, name=(chat_data.name or "").strip(), email=str(chat_data.email) if chat_data.email else "")
-                    db.add(lead)
-                    db.commit()
-            except Exception:
-                db.rollback()
-                # don't fail the chat on lead save error
-                pass
+        # Persist the user message and assistant reply together; an error reply is shown
+        # to the visitor but never stored as a bot message
+        saved = True
+        await run_in_threadpool(_persist_chat_turn, db, turn, None if source == SOURCE_SERVER_ERROR else reply)
 
-        # Persist the current user message
-        user_msg = Message(session_id=sess.id, role="user", content=chat_data.message)
-        db.add(user_msg)
-        
-        # Update session's last_message_at timestamp
-        sess.last_message_at = func.now()
-        
-        # Set session title from first user message if not already set
-        if not sess.title:
-            sess.title = chat_data.message[:50] + "..." if len(chat_data.message) > 50 else chat_data.message
-        
-        db.add(sess)
-        db.commit()
-        db.refresh(user_msg)
-
-        # Get messaging configuration
-        messaging_cfg = _get_or_create_messaging_config(db)
-        messaging_config = {
-            'ai_model': messaging_cfg.ai_model,
-            'conversational': messaging_cfg.conversational,
-            'strict_faq': messaging_cfg.strict_faq,
-            'response_length': messaging_cfg.response_length,
-            'suggest_followups': messaging_cfg.suggest_followups,
-            'welcome_message': messaging_cfg.welcome_message,
-            'server_error_message': messaging_cfg.server_error_message
-        }
+        return ChatResponseOut(reply=reply, used_faq=used_kb, run_id=source)
 
-        # Generate response with token-budgeted history and messaging config
-        reply, used_kb = rag_service.generate_rag_response(
-            chat_data.message, system_prompt, db, history=history, messaging_config=messaging_config
-        )
+    except Exception as e:
+        print(f"Error handling chat: {e}")
+        await run_in_threadpool(db.rollback)
+        if turn is not None and not saved:
+            # No reply was generated; still keep the visitor's message
+            try:
+                await run_in_threadpool(_persist_chat_turn, db, turn, None)
+            except Exception as save_error:
+                await run_in_threadpool(db.rollback)
+                print(f"Error saving chat message: {save_error}")
+        return ChatResponseOut(reply=await run_in_threadpool(_server_error_message, db), used_faq=False, run_id="server-error")
+    finally:
+        _record_chat_db_stats(db)
+
+def _server_error_message(db: Session) -> str:
+    """The configured server_error_message, shown instead of raw exception text."""
+    try:
+        return prompt_cache.get(db).messaging_config['server_error_message']
+    except Exception:
+        return "Apologies, there seems to be a server error."
 
-        # Persist assistant reply
-        assistant_msg = Message(session_id=sess.id, role="assistant", content=reply)
-        db.add(assistant_msg)
-        
-        # Update session's last_message_at timestamp again for assistant message
-        sess.last_message_at = func.now()
-        db.add(sess)
-        db.commit()
+def _save_streamed_turn(db: Session, turn: ChatTurn, reply: str | None) -> None:
+    # The request-scoped session may already be closed once streaming starts,
+    # so the turn is written with its own session
+    write_db = SessionLocal()
+    try:
+        _persist_chat_turn(write_db, turn, reply)
+    except Exception:
+        write_db.rollback()
+        raise
+    finally:
+        _record_chat_db_stats(db, write_db)
+        write_db.close()
 
-        return ChatResponseOut(reply=reply, used_faq=used_kb, run_id="rag-response")
+def _sse(data: dict, event: str | None = None) -> str:
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
 
+@app.post("/chat/stream")
+@limiter.limit("30/minute")
+async def chat_stream(request: Request, chat_data: ChatIn, x_client_id: str | None = Header(default=None), x_forwarded_for: str | None = Header(default=None), x_real_ip: str | None = Header(default=None), db: Session = Depends(get_db)):
+    """Server-Sent Events variant of /chat.
+    Emits `data: {"token": ...}` events as the completion streams in, then an `event: done`
+    with the full reply. The assistant message is persisted once the stream completes;
+    if the client disconnects, generation is stopped and only the user message is persisted.
+    Errors are reported with the configured server_error_message, never raw exception text.
+    """
+    turn = None
+    try:
+        turn, history, history_tokens, prompt = await run_in_threadpool(
+            _prepare_chat_turn, db, chat_data, x_client_id, _client_ip(x_forwarded_for, x_real_ip)
+        )
+        stream, used_kb, source = await rag_service.astream_rag_response(
+            chat_data.message, prompt, db, history=history, history_tokens=history_tokens
+        )
     except Exception as e:
-        db.rollback()
-        return ChatResponseOut(reply=f"Error: {str(e)}", used_faq=False, run_id=None)
+        print(f"Error handling chat stream: {e}")
+        await run_in_threadpool(db.rollback)
+        error = await run_in_threadpool(_server_error_message, db)
+        if turn is not None:
+            try:
+                await run_in_threadpool(_save_streamed_turn, db, turn, None)
+            except Exception as save_error:
+                print(f"Error saving chat message: {save_error}")
+
+        async def error_events():
+            yield _sse({"error": error}, event="error")
+        return StreamingResponse(error_events(), media_type="text/event-stream")
+
+    async def tokens():
+        if isinstance(stream, str):
+            # Answered without a completion (e.g. direct FAQ answer)
+            yield stream
+            return
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def save(reply: str | None) -> None:
+        try:
+            await run_in_threadpool(_save_streamed_turn, db, turn, reply)
+        except Exception as e:
+            print(f"Error saving streamed turn: {e}")
+
+    async def events():
+        parts: list[str] = []
+        saved = False
+        try:
+            completed = False
+            try:
+                async for token in tokens():
+                    if await request.is_disconnected():
+                        break
+                    parts.append(token)
+                    yield _sse({"token": token})
+                else:
+                    completed = True
+            except Exception as e:
+                print(f"Error streaming chat reply: {e}")
+                yield _sse({"error": prompt.messaging_config.get('server_error_message') or DEFAULT_MESSAGING_CONFIG['server_error_message']}, event="error")
+            if completed:
+                reply = "".join(parts)
+                saved = True
+                # An error reply is shown to the visitor but never stored as a bot message
+                await save(None if source == SOURCE_SERVER_ERROR else reply)
+                yield _sse({"reply": reply, "used_faq": used_kb, "run_id": source}, event="done")
+        finally:
+            # Runs however the stream ends, including when Starlette cancels or closes the
+            # body iterator on disconnect; shielded so that cancellation cannot skip the save.
+            # Without a completed reply only the user message is kept.
+            with anyio.CancelScope(shield=True):
+                if not isinstance(stream, str):
+                    await stream.close()
+                if not saved:
+                    await save(None)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/system-prompt", response_model=SystemPromptOut)
 async def get_system_prompt(db: Session = Depends(get_db)):
@@ -714,6 +959,7 @@ async def update_messaging_config(data: MessagingConfigIn, db: Session = Depends
     db.add(cfg)
     db.commit()
     db.refresh(cfg)
+    _invalidate_prompt_caches()
     
     return MessagingConfigOut(
         ai_model=cfg.ai_model,
@@ -905,8 +1151,13 @@ async def submit_dynamic_form(payload: dict, x_client_id: str | None = Header(de
 # Chat/message aliases under /api for embedders that prefix paths
 @app.post("/api/chat", response_model=ChatResponseOut)
 @limiter.limit("30/minute")
-async def chat_api(request: Request, chat_data: ChatIn, x_client_id: str | None = Header(default=None), db: Session = Depends(get_db)):
-    return await chat(request=request, chat_data=chat_data, x_client_id=x_client_id, db=db)
+async def chat_api(request: Request, chat_data: ChatIn, x_client_id: str | None = Header(default=None), x_forwarded_for: str | None = Header(default=None), x_real_ip: str | None = Header(default=None), db: Session = Depends(get_db)):
+    return await chat(request=request, chat_data=chat_data, x_client_id=x_client_id, x_forwarded_for=x_forwarded_for, x_real_ip=x_real_ip, db=db)
+
+@app.post("/api/chat/stream")
+@limiter.limit("30/minute")
+async def chat_stream_api(request: Request, chat_data: ChatIn, x_client_id: str | None = Header(default=None), x_forwarded_for: str | None = Header(default=None), x_real_ip: str | None = Header(default=None), db: Session = Depends(get_db)):
+    return await chat_stream(request=request, chat_data=chat_data, x_client_id=x_client_id, x_forwarded_for=x_forwarded_for, x_real_ip=x_real_ip, db=db)
 
 @app.get("/api/messages")
 async def get_messages_api(x_client_id: str | None = Header(default=None), db: Session = Depends(get_db)):
@@ -927,6 +1178,7 @@ async def set_system_prompt(prompt_data: SystemPromptIn, db: Session = Depends(g
         )
         db.add(new_prompt)
         db.commit()
+        _invalidate_prompt_caches()
 
         return SystemPromptOut(text=prompt_data.text, is_custom=True)
     except Exception as e:
@@ -941,15 +1193,18 @@ async def reset_system_prompt(db: Session = Depends(get_db), _: bool = Depends(r
         if existing_prompt:
             db.delete(existing_prompt)
             db.commit()
+        _invalidate_prompt_caches()
         
         return {"message": "System prompt reset to default"}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error resetting system prompt: {str(e)}")
 
-@app.post("/documents/upload", response_model=DocumentUploadOut)
+@app.post("/documents/upload", response_model=IngestionJobOut, status_code=202)
 async def upload_document(file: UploadFile = File(...), db: Session = Depends(get_db), _: bool = Depends(require_admin)):
-    """Upload and process a document for the knowledge base"""
+    """Upload a document and queue it for background ingestion into the knowledge base.
+    Returns a job id immediately; poll /documents/jobs/{job_id} for progress.
+    """
     try:
         # Validate file extension
         allowed_extensions = {'.pdf', '.docx', '.txt'}
@@ -965,26 +1220,39 @@ async def upload_document(file: UploadFile = File(...), db: Session = Depends(ge
         if file_extension == '.docx' and not header.startswith(b'PK\x03\x04'):
             raise HTTPException(status_code=400, detail="File content does not match DOCX format")
 
-        # Save uploaded file
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Process document with RAG service
-        document = rag_service.process_document(db, str(file_path), file.filename)
+        # Claim a slot in the bounded background ingestion pool before touching disk
+        try:
+            job = ingestion_queue.reserve(file.filename)
+        except RuntimeError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+
+        # Save uploaded file under a per-job name: an upload with the same filename
+        # must not overwrite a file a queued or running job is still reading
+        file_path = UPLOAD_DIR / f"{job.id}_{Path(file.filename).name}"
+        try:
+            with open(file_path, "wb") as buffer:
+                await run_in_threadpool(shutil.copyfileobj, file.file, buffer)
+        except Exception:
+            ingestion_queue.release(job)
+            file_path.unlink(missing_ok=True)
+            raise
+        ingestion_queue.start(job, str(file_path))
         
-        return DocumentUploadOut(
-            id=document.id,
-            filename=document.filename,
-            document_type=document.document_type,
-            upload_date=document.upload_date.isoformat(),
-            processed=document.processed,
-            chunk_count=document.chunk_count
-        )
+        return IngestionJobOut(**job.to_dict())
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
+@app.get("/documents/jobs/{job_id}", response_model=IngestionJobOut)
+async def get_ingestion_job(job_id: str, _: bool = Depends(require_admin)):
+    """Report stage, chunks processed and throughput for a background ingestion job"""
+    job = ingestion_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return IngestionJobOut(**job.to_dict())
+
 @app.get("/documents", response_model=DocumentListOut)
 async def list_documents(db: Session = Depends(get_db)):
     """List all documents in the knowledge base"""
@@ -1514,12 +1782,15 @@ async def get_chat_interface():
             }, 3000);
         }
         
+        let documentStatusTimer = null;
         function showDocumentStatus(message, type) {
             const status = document.getElementById('documentStatus');
             status.textContent = message;
             status.className = `status ${type}`;
             status.style.display = 'block';
-            setTimeout(() => {
+            // Progress updates replace each other; only the latest one schedules the hide
+            clearTimeout(documentStatusTimer);
+            documentStatusTimer = setTimeout(() => {
                 status.style.display = 'none';
             }, 3000);
         }
@@ -1556,9 +1827,9 @@ async def get_chat_interface():
                 const result = await response.json();
                 
                 if (response.ok) {
-                    showDocumentStatus(`Document "${result.filename}" uploaded successfully! Processed into ${result.chunk_count} chunks.`, 'success');
                     fileInput.value = ''; // Clear file input
-                    loadDocuments(); // Refresh document list
+                    // Ingestion runs in the background; follow the job until it finishes
+                    await pollIngestionJob(result.job_id, result.filename);
                 } else {
                     showDocumentStatus('Error: ' + result.detail, 'error');
                 }
@@ -1567,6 +1838,30 @@ async def get_chat_interface():
             }
         }
         
+        async function pollIngestionJob(jobId, filename) {
+            while (true) {
+                const response = await fetch(`/documents/jobs/${jobId}`);
+                const job = await response.json();
+                if (!response.ok) {
+                    showDocumentStatus('Error: ' + job.detail, 'error');
+                    return;
+                }
+                if (job.status === 'completed') {
+                    showDocumentStatus(`Document "${filename}" processed into ${job.chunks_processed} chunks.`, 'success');
+                    loadDocuments(); // Refresh document list
+                    return;
+                }
+                if (job.status === 'failed') {
+                    showDocumentStatus(`Error processing "${filename}": ${job.error}`, 'error');
+                    loadDocuments();
+                    return;
+                }
+                const progress = job.total_chunks ? ` (${job.chunks_processed}/${job.total_chunks} chunks)` : (job.chunks_processed ? ` (${job.chunks_processed} chunks)` : '');
+                showDocumentStatus(`"${filename}": ${job.stage}${progress}...`, 'success');
+                await new Promise(resolve => setTimeout(resolve, 1000));
+            }
+        }
+        
         async function loadDocuments() {
             try {
                 const response = await fetch('/documents');
@@ -1886,6 +2181,67 @@ async def debug_kb_status(db: Session = Depends(get_db), _: bool = Depends(requi
             "traceback": traceback.format_exc()
         }
 
+@app.get("/debug/embedding-cache")
+async def debug_embedding_cache(_: bool = Depends(require_admin)):
+    """Hit/miss counters and size of the persistent embedding cache"""
+    cache = rag_service.embedding_cache
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, "model": rag_service.embedding_model_name, **cache.stats()}
+
+@app.get("/debug/embedding-batcher")
+async def debug_embedding_batcher(_: bool = Depends(require_admin)):
+    """Queue depth and batch-size histogram of the query embedding scheduler"""
+    batcher = rag_service.query_batcher
+    if batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **batcher.stats()}
+
+@app.get("/debug/llm-client")
+async def debug_llm_client(_: bool = Depends(require_admin)):
+    """Connection reuse and per-call latency of the shared OpenAI client"""
+    return rag_service.llm.stats()
+
+@app.get("/debug/retrieval-timings")
+async def debug_retrieval_timings(_: bool = Depends(require_admin)):
+    """Per-stage retrieval latency (embedding, FAQ lexical/vector, KB search) over recent chats"""
+    return rag_service.retrieval_stats()
+
+@app.get("/debug/model-router")
+async def debug_model_router(_: bool = Depends(require_admin)):
+    """Routing decisions and completion latency per route (trivial / faq_exact / complex)"""
+    return rag_service.router.stats()
+
+@app.get("/debug/response-sources")
+async def debug_response_sources(_: bool = Depends(require_admin)):
+    """Replies per source (LLM, response cache, direct FAQ answer) and LLM calls saved"""
+    return rag_service.response_source_stats()
+
+@app.get("/debug/chat-persistence")
+async def debug_chat_persistence(_: bool = Depends(require_admin)):
+    """Commits and DB time per chat, and write-behind queue/batching counters"""
+    return chat_writer.stats()
+
+@app.get("/debug/client-session-cache")
+async def debug_client_session_cache(_: bool = Depends(require_admin)):
+    """Hit rate of the client_id -> session cache used by /chat"""
+    return client_session_cache.stats()
+
+@app.get("/debug/summarizer")
+async def debug_summarizer(_: bool = Depends(require_admin)):
+    """Background conversation summarizer runs and folded message counts"""
+    if summarizer is None:
+        return {"enabled": False}
+    return {"enabled": True, **summarizer.stats()}
+
+@app.get("/debug/response-cache")
+async def debug_response_cache(_: bool = Depends(require_admin)):
+    """Hit rate and estimated LLM cost saved by the semantic response cache"""
+    cache = rag_service.response_cache
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, "kb_version": rag_service.kb_version, **cache.stats()}
+
 # ---------------------- FAQ endpoints ----------------------
 
 @app.post("/faqs/upload-csv")
@@ -1915,6 +2271,7 @@ async def upload_faqs_csv(file: UploadFile = File(...), db: Session = Depends(ge
 
         created = 0
         skipped = 0
+        new_faqs: list[FAQ] = []
         for row in reader:
             try:
                 values = list(row.values())
@@ -1925,11 +2282,16 @@ async def upload_faqs_csv(file: UploadFile = File(...), db: Session = Depends(ge
                     continue
                 faq = FAQ(question=question, answer=answer)
                 db.add(faq)
+                new_faqs.append(faq)
                 created += 1
             except Exception:
                 skipped += 1
         if created:
+            db.flush()
+            indexed = [(f.id, f.question, f.answer) for f in new_faqs]
             db.commit()
+            # Embedding a large import takes a while; keep it off the event loop
+            await run_in_threadpool(rag_service.upsert_faqs, indexed)
         return {"created": created, "skipped": skipped}
     except HTTPException:
         raise
@@ -1960,6 +2322,7 @@ async def update_faq(faq_id: int, faq_data: FAQIn, db: Session = Depends(get_db)
         db.add(faq)
         db.commit()
         db.refresh(faq)
+        await run_in_threadpool(rag_service.upsert_faqs, [(faq.id, faq.question, faq.answer)])
         return {"id": faq.id, "question": faq.question, "answer": faq.answer}
     except HTTPException:
         raise
@@ -1975,6 +2338,7 @@ async def delete_faq(faq_id: int, db: Session = Depends(get_db), _: bool = Depen
             raise HTTPException(status_code=404, detail="FAQ not found")
         db.delete(faq)
         db.commit()
+        await run_in_threadpool(rag_service.remove_faq, faq_id)
         return {"success": True}
     except HTTPException:
         raise
@@ -2053,7 +2417,7 @@ async def get_chat_detail(chat_id: int, db: Session = Depends(get_db), _: bool =
             raise HTTPException(status_code=404, detail="Chat not found")
         
         # Get all messages for this session
-        messages = db.query(Message).filter(Message.session_id == chat_id).order_by(Message.created_at.asc()).all()
+        messages = db.query(Message).filter(Message.session_id == chat_id).order_by(Message.created_at.asc(), Message.id.asc()).all()
         
         # Get user info from lead if available
         lead = db.query(Lead).filter(Lead.client_id == session.user.external_user_id).first()
@@ -2132,6 +2496,7 @@ async def delete_chat(chat_id: int, db: Session = Depends(get_db), _: bool = Dep
         # Delete the session
         db.delete(session)
         db.commit()
+        client_session_cache.invalidate_session(chat_id)
         
         return {"success": True, "message": "Chat deleted successfully"}
     except HTTPException:
@@ -2161,6 +2526,7 @@ async def delete_user(user_id: int, db: Session = Depends(get_db), _: bool = Dep
         # Delete the user
         db.delete(user)
         db.commit()
+        client_session_cache.invalidate_user(user_id)
         
         return {"success": True, "message": "User and all associated data deleted successfully"}
     except HTTPException:
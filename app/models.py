@@ -38,6 +38,7 @@ class Message(Base):
     session_id: Mapped[int] = mapped_column(ForeignKey("sessions.id", ondelete="CASCADE"), index=True)
     role: Mapped[str] = mapped_column(String(16))  # "user" / "assistant" / "system"
     content: Mapped[str] = mapped_column(Text)
+    token_count: Mapped[int | None] = mapped_column(Integer, nullable=True)  # content tokens, computed once on write
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
     session = relationship("Session", back_populates="messages")
@@ -78,6 +79,7 @@ class DocumentChunk(Base):
     chunk_text: Mapped[str] = mapped_column(Text)
     chunk_index: Mapped[int] = mapped_column(Integer)  # Order of chunk in document
     vector_id: Mapped[str] = mapped_column(String(255))  # ID in vector database
+    content_hash: Mapped[str | None] = mapped_column(String(64), index=True, nullable=True)  # sha256 of chunk_text
 
 class DocumentVisibility(Base):
     __tablename__ = "document_visibility"
@@ -63,6 +63,17 @@ class DocumentUploadOut(BaseModel):
     processed: bool
     chunk_count: int
 
+class IngestionJobOut(BaseModel):
+    job_id: str
+    filename: str
+    status: str
+    stage: str
+    chunks_processed: int = 0
+    total_chunks: int = 0
+    chunks_per_sec: float = 0.0
+    document_id: Optional[int] = None
+    error: Optional[str] = None
+
 class DocumentListOut(BaseModel):
     documents: List[DocumentUploadOut]
 
@@ -0,0 +1,262 @@
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from sqlalchemy import func, update
+
+from db import SessionLocal
+from models import Lead, Message, Session as ChatSession, User
+
+
+class ChatTurn:
+    """Rows written for one chat exchange: the user message, the assistant reply (None when
+    no reply was produced), the session's last_message_at/title, the user's last_activity
+    and an optional lead upsert."""
+
+    __slots__ = (
+        "session_id", "user_id", "client_id", "user_message", "user_tokens", "user_at",
+        "title", "lead_name", "lead_email", "reply", "reply_tokens", "reply_at",
+    )
+
+    def __init__(self, session_id: int, user_id: int, client_id: str, user_message: str, user_tokens: int,
+                 title: Optional[str] = None, lead_name: Optional[str] = None, lead_email: Optional[str] = None):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.client_id = client_id
+        self.user_message = user_message
+        self.user_tokens = user_tokens
+        # Timestamps are taken when each side happened, not at commit time, so both
+        # messages of a turn written in one transaction still sort correctly
+        self.user_at = datetime.now(timezone.utc)
+        self.title = title
+        self.lead_name = lead_name
+        self.lead_email = lead_email
+        self.reply = None
+        self.reply_tokens = None
+        self.reply_at = None
+
+    def set_reply(self, reply: str, reply_tokens: int) -> None:
+        self.reply = reply
+        self.reply_tokens = reply_tokens
+        self.reply_at = datetime.now(timezone.utc)
+
+
+def _upsert_lead(db, turn: ChatTurn) -> None:
+    # Savepoint: a failed lead upsert must not take the messages down with it
+    try:
+        with db.begin_nested():
+            existing = (
+                db.query(Lead)
+                .filter(Lead.client_id == turn.client_id)
+                .order_by(Lead.id.desc())
+                .first()
+            )
+            if existing:
+                if turn.lead_name:
+                    existing.name = turn.lead_name
+                if turn.lead_email:
+                    existing.email = turn.lead_email
+            else:
+                db.add(Lead(user_id=turn.user_id, client_id=turn.client_id, name=turn.lead_name or "", email=turn.lead_email or ""))
+    except Exception as e:
+        print(f"Error saving lead for client {turn.client_id}: {e}")
+
+
+def write_turns(db, turns: List[ChatTurn]) -> None:
+    """Write the turns in one transaction on ``db`` and commit once."""
+    messages = []
+    for turn in turns:
+        messages.append(Message(session_id=turn.session_id, role="user", content=turn.user_message,
+                                token_count=turn.user_tokens, created_at=turn.user_at))
+        if turn.reply is not None:
+            messages.append(Message(session_id=turn.session_id, role="assistant", content=turn.reply,
+                                    token_count=turn.reply_tokens, created_at=turn.reply_at))
+    db.add_all(messages)
+    for turn in turns:
+        values = {"last_message_at": func.now()}
+        if turn.title:
+            values["title"] = func.coalesce(ChatSession.title, turn.title)
+        db.execute(update(ChatSession).where(ChatSession.id == turn.session_id).values(**values))
+        if turn.lead_name or turn.lead_email:
+            _upsert_lead(db, turn)
+    # The inbox ordering and active-user analytics read last_activity
+    user_ids = {turn.user_id for turn in turns}
+    db.execute(update(User).where(User.id.in_(user_ids)).values(last_activity=func.now()))
+    db.commit()
+
+
+class ChatTurnWriter:
+    """Persists chat turns inline or through a bounded write-behind queue.
+
+    Inline (the default) a turn is one transaction on the request's DB session.
+    With ``write_behind`` a background thread drains the queue and writes up to
+    ``max_batch`` turns per transaction, so concurrent chats share commits; when
+    the queue is full the turn is written inline instead. Readers of a session's
+    history call wait_for_session() first so a queued turn is never missing.
+    Per-chat commit counts and DB time reported by the chat endpoints are kept
+    for the admin metrics endpoint.
+    """
+
+    def __init__(
+        self,
+        write_behind: bool = False,
+        max_pending: int = 1000,
+        max_batch: int = 50,
+        on_written: Optional[Callable[[List[ChatTurn]], None]] = None,
+        window: int = 1000,
+    ):
+        self.write_behind = write_behind
+        self.max_batch = max(1, max_batch)
+        self.on_written = on_written
+        self.turns_written = 0
+        self.transactions = 0
+        self.inline_writes = 0
+        self.queue_full = 0
+        self.failures = 0
+        self._pending: dict = {}
+        self._cond = threading.Condition()
+        self._chat_commits: deque = deque(maxlen=window)
+        self._chat_db_seconds: deque = deque(maxlen=window)
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_pending))
+        self._thread = None
+        if write_behind:
+            self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, db, turn: ChatTurn) -> None:
+        """Persist a turn: queued when write-behind is on and there is room, else written now on ``db``."""
+        if self.write_behind:
+            with self._cond:
+                self._pending[turn.session_id] = self._pending.get(turn.session_id, 0) + 1
+            try:
+                self._queue.put_nowait(turn)
+                return
+            except queue.Full:
+                self._done([turn])
+                with self._cond:
+                    self.queue_full += 1
+        write_turns(db, [turn])
+        with self._cond:
+            self.inline_writes += 1
+            self.turns_written += 1
+            self.transactions += 1
+        self._notify([turn])
+
+    def wait_for_session(self, session_id: int, timeout: float = 5.0) -> bool:
+        """Block until no turn of the session is queued. Returns False on timeout."""
+        if not self.write_behind:
+            return True
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending.get(session_id), timeout)
+
+    def record_chat(self, commits: int, db_seconds: float) -> None:
+        with self._cond:
+            self._chat_commits.append(commits)
+            self._chat_db_seconds.append(db_seconds)
+
+    def _run(self) -> None:
+        while True:
+            turn = self._queue.get()
+            if turn is None:
+                return
+            batch = [turn]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    turn = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if turn is None:
+                    stop = True
+                    break
+                batch.append(turn)
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[ChatTurn]) -> None:
+        db = SessionLocal()
+        try:
+            write_turns(db, batch)
+        except Exception as e:
+            db.rollback()
+            if len(batch) > 1:
+                # One bad turn (e.g. its session was deleted) must not drop the others
+                db.close()
+                for turn in batch:
+                    self._write_batch([turn])
+                return
+            with self._cond:
+                self.failures += 1
+            print(f"Error writing chat turn for session {batch[0].session_id}: {e}")
+            self._done(batch)
+            return
+        finally:
+            db.close()
+        with self._cond:
+            self.turns_written += len(batch)
+            self.transactions += 1
+        self._done(batch)
+        self._notify(batch)
+
+    def _done(self, turns: List[ChatTurn]) -> None:
+        with self._cond:
+            for turn in turns:
+                left = self._pending.get(turn.session_id, 0) - 1
+                if left > 0:
+                    self._pending[turn.session_id] = left
+                else:
+                    self._pending.pop(turn.session_id, None)
+            self._cond.notify_all()
+
+    def _notify(self, turns: List[ChatTurn]) -> None:
+        if self.on_written is not None:
+            try:
+                self.on_written(turns)
+            except Exception as e:
+                print(f"Error in chat write callback: {e}")
+
+    def stats(self) -> dict:
+        with self._cond:
+            commits = list(self._chat_commits)
+            db_ms = sorted(s * 1000.0 for s in self._chat_db_seconds)
+            pending = sum(self._pending.values())
+            turns_written = self.turns_written
+            transactions = self.transactions
+            counters = {
+                "inline_writes": self.inline_writes,
+                "queue_full_fallbacks": self.queue_full,
+                "failures": self.failures,
+            }
+
+        def percentile(p: float) -> Optional[float]:
+            if not db_ms:
+                return None
+            return round(db_ms[min(len(db_ms) - 1, int(round(p * (len(db_ms) - 1))))], 2)
+
+        return {
+            "mode": "write-behind" if self.write_behind else "inline",
+            "pending": pending,
+            "turns_written": turns_written,
+            "transactions": transactions,
+            "turns_per_transaction": round(turns_written / transactions, 2) if transactions else 0.0,
+            **counters,
+            "per_chat": {
+                "chats": len(commits),
+                "commits_avg": round(sum(commits) / len(commits), 2) if commits else 0.0,
+                "commits_max": max(commits) if commits else 0,
+                "db_ms": {"p50": percentile(0.50), "p95": percentile(0.95), "max": round(db_ms[-1], 2) if db_ms else None},
+            },
+        }
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Flush what is queued (bounded by ``timeout``) and stop the writer thread."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
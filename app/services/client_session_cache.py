@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class ClientSessionEntry:
+    """What the chat hot path needs to know about a client without querying users/sessions."""
+
+    __slots__ = ("user_id", "session_id", "ip_address", "has_name", "has_email", "expires_at")
+
+    def __init__(self, user_id: int, session_id: int, ip_address: Optional[str], has_name: bool, has_email: bool, expires_at: float):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.ip_address = ip_address
+        self.has_name = has_name
+        self.has_email = has_email
+        self.expires_at = expires_at
+
+
+class ClientSessionCache:
+    """In-process TTL cache mapping client_id -> (user_id, open session_id).
+
+    Per process, like the other in-memory caches; the inbox delete endpoints
+    invalidate entries for deleted users and sessions, and a cached session
+    that has disappeared or closed is dropped by the caller on use.
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0, max_entries: int = 10_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, ClientSessionEntry]" = OrderedDict()
+
+    def get(self, client_id: str) -> Optional[ClientSessionEntry]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(client_id)
+            if entry is None or entry.expires_at < now:
+                if entry is not None:
+                    del self._entries[client_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(client_id)
+            self.hits += 1
+            return entry
+
+    def put(self, client_id: str, user_id: int, session_id: int, ip_address: Optional[str], has_name: bool, has_email: bool) -> None:
+        entry = ClientSessionEntry(user_id, session_id, ip_address, has_name, has_email, time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            self._entries[client_id] = entry
+            self._entries.move_to_end(client_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, client_id: str) -> None:
+        with self._lock:
+            self._entries.pop(client_id, None)
+
+    def invalidate_session(self, session_id: int) -> None:
+        with self._lock:
+            for client_id in [c for c, e in self._entries.items() if e.session_id == session_id]:
+                del self._entries[client_id]
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for client_id in [c for c, e in self._entries.items() if e.user_id == user_id]:
+                del self._entries[client_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,180 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+from db import SessionLocal
+from models import Message, Session as ChatSession
+from services.llm_client import LLMClient, LLMUnavailableError
+
+SUMMARY_KEY = "summary"
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a customer support chat. Merge the new turns into the "
+    "existing summary. Keep facts the assistant may need later: the visitor's name, contact "
+    "details, what they asked for, answers already given, decisions and open questions. "
+    "Write plain prose in the third person, no greeting, at most {max_words} words."
+)
+
+
+def get_summary(chat_session: ChatSession) -> Optional[dict]:
+    """The stored rolling summary {"text", "through_message_id", ...} of a session, if any."""
+    summary = (chat_session.session_metadata or {}).get(SUMMARY_KEY)
+    return summary if summary and summary.get("text") else None
+
+
+def summary_message(summary: dict) -> dict:
+    """History entry that stands in for the turns folded into the summary."""
+    return {"role": "system", "content": f"Summary of the earlier conversation: {summary['text']}"}
+
+
+class ConversationSummarizer:
+    """Folds turns that fall out of the raw history window into a per-session summary.
+
+    Runs on a single background thread, off the request path. After a reply is
+    saved the session is scheduled; if its unsummarized turns exceed
+    ``trigger_tokens``, everything except the newest ``keep_recent_tokens`` is
+    merged into ``session_metadata["summary"]`` and later requests send that
+    summary block instead of the old raw turns.
+    """
+
+    def __init__(
+        self,
+        llm: LLMClient,
+        model: str = "gpt-4o-mini",
+        trigger_tokens: int = 2000,
+        keep_recent_tokens: int = 800,
+        max_summary_tokens: int = 300,
+        deadline: float = 30.0,
+        max_fold_messages: int = 200,
+    ):
+        self.llm = llm
+        self.model = model
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent_tokens = keep_recent_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.deadline = deadline
+        self.max_fold_messages = max_fold_messages
+        self.runs = 0
+        self.failures = 0
+        self.folded_messages = 0
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+
+    def schedule(self, session_id: int) -> None:
+        """Queue a session for a summary check; a session already queued is not queued twice."""
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        try:
+            self._executor.submit(self._run, session_id)
+        except RuntimeError:
+            # Executor shut down
+            with self._lock:
+                self._pending.discard(session_id)
+
+    def _run(self, session_id: int) -> None:
+        with self._lock:
+            self._pending.discard(session_id)
+        db = SessionLocal()
+        try:
+            self.summarize(db, session_id)
+        except Exception as e:
+            db.rollback()
+            with self._lock:
+                self.failures += 1
+            print(f"Error summarizing session {session_id}: {e}")
+        finally:
+            db.close()
+
+    def summarize(self, db, session_id: int) -> bool:
+        """Fold old turns of one session into its summary. Returns True when the summary changed."""
+        chat_session = db.get(ChatSession, session_id)
+        if chat_session is None:
+            return False
+        summary = get_summary(chat_session) or {}
+        through_id = summary.get("through_message_id", 0)
+
+        rows = (
+            db.query(Message.id, Message.role, Message.content, Message.token_count)
+            .filter(
+                Message.session_id == session_id,
+                Message.id > through_id,
+                Message.role.in_(("user", "assistant")),
+            )
+            .order_by(Message.id.desc())
+            .limit(self.max_fold_messages)
+            .all()
+        )
+        tokens = [row.token_count if row.token_count is not None else len(row.content) // 4 + 1 for row in rows]
+        if sum(tokens) < self.trigger_tokens:
+            return False
+
+        # Newest turns stay raw; everything older is folded
+        kept_tokens = 0
+        split = len(rows)
+        for i, n in enumerate(tokens):
+            if kept_tokens + n > self.keep_recent_tokens:
+                split = i
+                break
+            kept_tokens += n
+        # Always leave the last exchange raw, however long it is
+        split = max(split, min(2, len(rows)))
+        fold = list(reversed(rows[split:]))
+        if not fold:
+            return False
+
+        transcript = "\n".join(f"{row.role.capitalize()}: {row.content}" for row in fold)
+        previous = summary.get("text") or "(none yet)"
+        try:
+            _, response = self.llm.complete_with_fallback(
+                [self.model],
+                self.deadline,
+                temperature=0.2,
+                max_tokens=self.max_summary_tokens,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(max_words=int(self.max_summary_tokens * 0.7))},
+                    {"role": "user", "content": f"Existing summary:\n{previous}\n\nNew turns:\n{transcript}"},
+                ],
+            )
+        except LLMUnavailableError as e:
+            with self._lock:
+                self.failures += 1
+            print(f"Summary for session {session_id} skipped: {e}")
+            return False
+        text = (response.choices[0].message.content or "").strip()
+        if not text:
+            return False
+
+        metadata = dict(chat_session.session_metadata or {})
+        metadata[SUMMARY_KEY] = {
+            "text": text,
+            "through_message_id": fold[-1].id,
+            "folded_messages": summary.get("folded_messages", 0) + len(fold),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        # Reassign so SQLAlchemy sees the JSON change
+        chat_session.session_metadata = metadata
+        db.commit()
+        with self._lock:
+            self.runs += 1
+            self.folded_messages += len(fold)
+        print(f"Summarized {len(fold)} messages of session {session_id} (through message {fold[-1].id})")
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "model": self.model,
+                "trigger_tokens": self.trigger_tokens,
+                "keep_recent_tokens": self.keep_recent_tokens,
+                "pending": len(self._pending),
+                "runs": self.runs,
+                "failures": self.failures,
+                "folded_messages": self.folded_messages,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
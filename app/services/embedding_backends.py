@@ -0,0 +1,145 @@
+"""
+Pluggable sentence-embedding backends for RAGService.
+
+- "sentence-transformers": PyTorch SentenceTransformer (default)
+- "fastembed": ONNX Runtime via fastembed (the variant the Dockerfile prefetches)
+- "onnx" / "onnx-int8": ONNX Runtime on an exported model directory
+  (model.onnx + tokenizer.json); "onnx-int8" dynamically quantizes the weights
+  to int8 on first load and reuses model_int8.onnx afterwards.
+
+All backends return L2-normalized float32 vectors so they are interchangeable
+for cosine search. Heavy libraries are imported lazily, so choosing an ONNX
+backend keeps torch out of the worker process.
+"""
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import numpy as np
+
+
+class EmbeddingBackend(ABC):
+    """encode(texts) -> (len(texts), dim) float32 array of normalized embeddings."""
+
+    name: str = "base"
+
+    @abstractmethod
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        ...
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.name = model_name
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+
+class FastEmbedBackend(EmbeddingBackend):
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        from fastembed import TextEmbedding
+        repo_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        self.model = TextEmbedding(model_name=repo_name)
+        self.name = f"{model_name}:fastembed"
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        vectors = np.vstack(list(self.model.embed(texts, batch_size=batch_size)))
+        return _normalize(vectors)
+
+
+class OnnxBackend(EmbeddingBackend):
+    def __init__(self, model_dir: str, model_name: str = "all-MiniLM-L6-v2", quantize: bool = False, max_length: int = 256):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, "model.onnx")
+        if quantize:
+            quantized_path = os.path.join(model_dir, "model_int8.onnx")
+            if not os.path.exists(quantized_path):
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+            model_path = quantized_path
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.name = f"{model_name}:onnx-int8" if quantize else f"{model_name}:onnx"
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        feeds = {k: v for k, v in feeds.items() if k in self.input_names}
+        hidden = self.session.run(None, feeds)[0]  # (batch, tokens, dim)
+        # Mean pooling over real tokens, as in the sentence-transformers model config
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        parts = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        return _normalize(np.vstack(parts))
+
+
+def create_embedding_backend(backend: str, model_name: str = "all-MiniLM-L6-v2", onnx_model_dir: Optional[str] = None) -> EmbeddingBackend:
+    backend = (backend or "sentence-transformers").strip().lower()
+    if backend in ("sentence-transformers", "torch"):
+        return SentenceTransformerBackend(model_name)
+    if backend == "fastembed":
+        return FastEmbedBackend(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        if not onnx_model_dir:
+            raise ValueError("EMBEDDING_ONNX_MODEL_DIR must point to a directory with model.onnx and tokenizer.json")
+        return OnnxBackend(onnx_model_dir, model_name=model_name, quantize=(backend == "onnx-int8"))
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+if __name__ == "__main__":
+    # Parity check: python -m services.embedding_backends <backend> [onnx_model_dir] [tolerance]
+    # Compares pairwise cosine similarities against the PyTorch model.
+    import sys
+
+    candidate_name = sys.argv[1] if len(sys.argv) > 1 else "fastembed"
+    model_dir = sys.argv[2] if len(sys.argv) > 2 else os.environ.get("EMBEDDING_ONNX_MODEL_DIR")
+    tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+
+    sentences = [
+        "What are your opening hours?",
+        "When is the clinic open?",
+        "How much does a hearing test cost?",
+        "Pricing for a hearing evaluation",
+        "Do you accept insurance?",
+        "Where are you located?",
+        "How do I reset my hearing aid?",
+        "My device is not charging overnight.",
+        "Can I book an appointment online?",
+        "The weather is nice today.",
+    ]
+
+    reference = SentenceTransformerBackend("all-MiniLM-L6-v2").encode(sentences)
+    candidate = create_embedding_backend(candidate_name, "all-MiniLM-L6-v2", model_dir).encode(sentences)
+
+    ref_sims = reference @ reference.T
+    cand_sims = candidate @ candidate.T
+    pair_diff = np.abs(ref_sims - cand_sims).max()
+    self_sims = np.sum(reference * candidate, axis=1)
+    print(f"backend={candidate_name}")
+    print(f"max |pairwise cosine diff| = {pair_diff:.4f} (tolerance {tolerance})")
+    print(f"min cosine(torch, candidate) per sentence = {self_sims.min():.4f}")
+    sys.exit(0 if pair_diff <= tolerance else 1)
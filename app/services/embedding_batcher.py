@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+
+class EmbeddingBatcher:
+    """Micro-batching scheduler for query embeddings.
+
+    Callers on any thread submit a single text and block on the result. A
+    background thread collects requests for up to ``max_wait_ms`` (or until
+    ``max_batch_size`` are waiting), encodes them in one forward pass and hands
+    each caller its vector, so concurrent chats share one batch instead of
+    competing with batch-size-1 passes.
+    """
+
+    HISTOGRAM_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+    def __init__(self, encode_fn: Callable[[List[str]], List[List[float]]], max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_queue_depth = 0
+        self._histogram = {b: 0 for b in self.HISTOGRAM_BUCKETS}
+        self._histogram_overflow = 0
+        self._queue_wait_total = 0.0
+        self._thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        fut: Future = Future()
+        self._queue.put((text, fut, time.perf_counter()))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self._max_queue_depth:
+                self._max_queue_depth = depth
+        return fut.result(timeout=timeout)
+
+    def _collect(self, first) -> tuple[list, bool]:
+        batch = [first]
+        stopping = False
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        return batch, stopping
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stopping = self._collect(first)
+            started = time.perf_counter()
+            unique_texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = dict(zip(unique_texts, self.encode_fn(unique_texts)))
+                for text, fut, _ in batch:
+                    fut.set_result(vectors[text])
+            except Exception as e:
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            self._record(batch, started)
+            if stopping:
+                return
+
+    def _record(self, batch: list, started: float) -> None:
+        size = len(batch)
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._queue_wait_total += sum(started - enqueued for _, _, enqueued in batch)
+            for bucket in self.HISTOGRAM_BUCKETS:
+                if size <= bucket:
+                    self._histogram[bucket] += 1
+                    break
+            else:
+                self._histogram_overflow += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            histogram = {f"<={b}": n for b, n in self._histogram.items()}
+            histogram[f">{self.HISTOGRAM_BUCKETS[-1]}"] = self._histogram_overflow
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "avg_queue_wait_ms": round(self._queue_wait_total / self._items * 1000.0, 3) if self._items else 0.0,
+                "batch_size_histogram": histogram,
+            }
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
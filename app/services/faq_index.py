@@ -0,0 +1,185 @@
+import heapq
+import math
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset({
+    "the", "and", "for", "are", "but", "not", "you", "your", "our", "with", "this", "that",
+    "what", "when", "where", "who", "how", "can", "does", "did", "was", "were", "has", "have",
+    "any", "all", "from", "they", "them", "their", "there", "about", "into", "will", "would",
+    "could", "should", "its", "his", "her", "she", "him", "which", "why", "also", "than", "then",
+})
+
+
+def _normalize_term(token: str) -> str:
+    # Light suffix stripping so "prices"/"price" and "booking"/"book" match
+    for suffix in ("ing", "ed"):
+        if len(token) > len(suffix) + 3 and token.endswith(suffix):
+            return token[: -len(suffix)]
+    if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        _normalize_term(t)
+        for t in TOKEN_RE.findall((text or "").lower())
+        if len(t) > 2 and t not in STOPWORDS
+    ]
+
+
+class FAQIndex:
+    """In-memory BM25 index over FAQ questions and answers.
+
+    Question terms count ``question_weight`` times as much as answer terms
+    (mirroring the old 3:1 substring scoring). The index is built once from the
+    database and kept current by upsert()/remove() from the FAQ endpoints; it is
+    per process, like the rest of RAGService's in-memory state.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, question_weight: int = 3, common_term_ratio: float = 0.5,
+                 common_term_min_docs: int = 500, min_contained_query_chars: int = 4):
+        self.k1 = k1
+        self.b = b
+        self.question_weight = question_weight
+        # Very common terms are only skipped in large indexes; in a small one a shared
+        # keyword such as "price" is exactly what the visitor is asking about
+        self.common_term_ratio = common_term_ratio
+        self.common_term_min_docs = common_term_min_docs
+        # Shorter queries ("a", "ok") are contained in almost every question
+        self.min_contained_query_chars = min_contained_query_chars
+        self.built = False
+        self._lock = threading.RLock()
+        self._docs: Dict[int, Tuple[str, str, Dict[str, int], int]] = {}  # id -> (question, answer, tf, length)
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._questions_lower: Dict[int, str] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def build(self, faqs: Iterable[Tuple[int, str, str]]) -> None:
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._questions_lower.clear()
+            self._total_length = 0
+            for faq_id, question, answer in faqs:
+                self._add_locked(faq_id, question, answer)
+            self.built = True
+
+    def get(self, faq_id: int) -> Optional[Tuple[str, str]]:
+        """(question, answer) for an indexed FAQ, or None."""
+        with self._lock:
+            doc = self._docs.get(faq_id)
+        return (doc[0], doc[1]) if doc is not None else None
+
+    def upsert(self, faq_id: int, question: str, answer: str) -> None:
+        with self._lock:
+            self._remove_locked(faq_id)
+            self._add_locked(faq_id, question, answer)
+
+    def remove(self, faq_id: int) -> None:
+        with self._lock:
+            self._remove_locked(faq_id)
+
+    def _add_locked(self, faq_id: int, question: str, answer: str) -> None:
+        tf: Dict[str, int] = {}
+        for term in tokenize(question):
+            tf[term] = tf.get(term, 0) + self.question_weight
+        for term in tokenize(answer):
+            tf[term] = tf.get(term, 0) + 1
+        length = sum(tf.values())
+        self._docs[faq_id] = (question, answer, tf, length)
+        self._questions_lower[faq_id] = (question or "").lower()
+        self._total_length += length
+        for term, count in tf.items():
+            self._postings.setdefault(term, {})[faq_id] = count
+
+    def _remove_locked(self, faq_id: int) -> None:
+        doc = self._docs.pop(faq_id, None)
+        if doc is None:
+            return
+        self._questions_lower.pop(faq_id, None)
+        _, _, tf, length = doc
+        self._total_length -= length
+        for term in tf:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(faq_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def _idf(self, df: int, n: int) -> float:
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def _contained_locked(self, query_lower: str, terms: List[str]) -> set:
+        """FAQs whose question contains the whole query. Checked apart from scoring, so it
+        still matches when no term scores. Only FAQs in every query term's posting list
+        can contain the query, so just those are scanned; a query without indexable
+        terms (only short words/stopwords) falls back to scanning all questions."""
+        if len(query_lower) < self.min_contained_query_chars:
+            return set()
+        if terms:
+            postings = sorted((self._postings.get(term) or {} for term in terms), key=len)
+            candidates = [faq_id for faq_id in postings[0] if all(faq_id in p for p in postings[1:])]
+        else:
+            candidates = self._questions_lower.keys()
+        return {faq_id for faq_id in candidates if query_lower in self._questions_lower[faq_id]}
+
+    def search(self, query: str, limit: int = 20, max_distance: float = 0.95) -> List[Tuple[str, float, dict]]:
+        """Return up to ``limit`` (faq_text, distance, metadata) tuples, best first.
+
+        A question containing the whole query scores distance 0.0, as before;
+        other matches map their BM25 score onto [0, 1) relative to the best score
+        the query's terms could reach.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        query_lower = (query or "").lower().strip()
+        with self._lock:
+            n = len(self._docs)
+            if not n or not (terms or query_lower):
+                return []
+            contained = self._contained_locked(query_lower, terms)
+            skip_common = n >= self.common_term_min_docs
+            avg_len = self._total_length / n if n else 1.0
+            scores: Dict[int, float] = {}
+            upper = 0.0
+            for term in terms:
+                posting = self._postings.get(term)
+                df = len(posting) if posting else 0
+                idf = self._idf(df, n)
+                upper += idf * (self.k1 + 1)
+                # Terms in most FAQs carry almost no signal and dominate scan cost
+                if not posting or (skip_common and df > self.common_term_ratio * n):
+                    continue
+                for faq_id, tf in posting.items():
+                    length = self._docs[faq_id][3]
+                    denom = tf + self.k1 * (1 - self.b + self.b * length / avg_len)
+                    scores[faq_id] = scores.get(faq_id, 0.0) + idf * tf * (self.k1 + 1) / denom
+            if not scores and not contained:
+                return []
+
+            top = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+            top_ids = {faq_id for faq_id, _ in top}
+            top.extend((faq_id, scores.get(faq_id, 0.0)) for faq_id in contained if faq_id not in top_ids)
+            results = []
+            for faq_id, score in top:
+                question, answer, _, _ = self._docs[faq_id]
+                if faq_id in contained:
+                    distance = 0.0
+                else:
+                    distance = 1.0 - min(1.0, score / upper) if upper > 0 else 1.0
+                if distance >= max_distance:
+                    continue
+                results.append((
+                    f"Q: {question}\nA: {answer}",
+                    distance,
+                    {"source": "faq", "faq_id": faq_id, "question": question},
+                ))
+        results.sort(key=lambda r: r[1])
+        return results[:limit]
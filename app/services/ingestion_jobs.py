@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from db import SessionLocal
+
+
+class IngestionJob:
+    """Progress record for one background document ingestion."""
+
+    def __init__(self, filename: str, file_path: str):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.file_path = file_path
+        self.status = "queued"  # queued / running / completed / failed
+        self.stage = "queued"  # queued / extracting / embedding / completed / failed
+        self.chunks_processed = 0
+        self.total_chunks = 0
+        self.document_id: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._embed_started_at: Optional[float] = None
+
+    def update(self, stage: str, processed: int = 0, total: int = 0) -> None:
+        """Progress callback handed to RAGService.process_document."""
+        if stage == "embedding" and self._embed_started_at is None:
+            self._embed_started_at = time.time()
+        self.stage = stage
+        self.chunks_processed = processed
+        self.total_chunks = total
+
+    @property
+    def chunks_per_sec(self) -> float:
+        if self._embed_started_at is None or not self.chunks_processed:
+            return 0.0
+        end = self.finished_at or time.time()
+        elapsed = end - self._embed_started_at
+        return self.chunks_processed / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "chunks_processed": self.chunks_processed,
+            "total_chunks": self.total_chunks,
+            "chunks_per_sec": round(self.chunks_per_sec, 2),
+            "document_id": self.document_id,
+            "error": self.error,
+        }
+
+
+class IngestionJobQueue:
+    """Bounded background worker pool for document ingestion.
+
+    Uploads are queued here and processed by at most ``max_workers`` threads so
+    several concurrent uploads can't starve the chat path. Job state lives in
+    process memory; finished jobs are pruned once ``max_history`` is exceeded.
+    """
+
+    def __init__(self, rag_service, max_workers: int = 1, max_pending: int = 20, max_history: int = 200):
+        self.rag_service = rag_service
+        self.max_pending = max_pending
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest")
+        self._jobs: dict[str, IngestionJob] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, filename: str) -> IngestionJob:
+        """Claim a queue slot before the upload is written to disk, so a full queue is
+        rejected without touching the filesystem. Raises RuntimeError when the queue is full."""
+        job = IngestionJob(filename=filename, file_path="")
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if j.status in ("queued", "running"))
+            if pending >= self.max_pending:
+                raise RuntimeError("Ingestion queue is full, try again later")
+            self._jobs[job.id] = job
+            self._prune_locked()
+        return job
+
+    def start(self, job: IngestionJob, file_path: str) -> None:
+        """Hand a reserved job its saved file and queue it for a worker."""
+        job.file_path = file_path
+        self._executor.submit(self._run, job)
+
+    def release(self, job: IngestionJob) -> None:
+        """Drop a reserved job whose upload could not be saved."""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune_locked(self) -> None:
+        finished = [j for j in self._jobs.values() if j.status in ("completed", "failed")]
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+        finished.sort(key=lambda j: j.finished_at or j.created_at)
+        for j in finished[:excess]:
+            self._jobs.pop(j.id, None)
+
+    def _run(self, job: IngestionJob) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        db = SessionLocal()
+        try:
+            doc = self.rag_service.process_document(db, job.file_path, job.filename, progress=job.update)
+            job.document_id = doc.id
+            job.finished_at = time.time()
+            job.stage = "completed"
+            job.status = "completed"
+        except Exception as e:
+            db.rollback()
+            job.error = str(e)
+            job.finished_at = time.time()
+            job.stage = "failed"
+            job.status = "failed"
+            print(f"Ingestion job {job.id} failed for {job.filename}: {e}")
+            # The upload is not referenced by any document; don't leave it behind
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
+        finally:
+            db.close()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,265 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+import httpx
+import openai
+
+
+class LLMUnavailableError(Exception):
+    """Every model in the fallback chain failed or ran out of time."""
+
+
+class LLMClient:
+    """Process-wide OpenAI client with a tuned HTTP connection pool.
+
+    One httpx client is shared by every request so keep-alive connections and
+    TLS sessions are reused. Timeouts and retries are explicit: the OpenAI SDK
+    retries connection errors, 408/409/429 and 5xx responses with exponential
+    backoff up to ``max_retries`` times. Per-call latency and connection reuse
+    are tracked for the admin metrics endpoint.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 2,
+        max_connections: int = 50,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+        latency_window: int = 1000,
+    ):
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._errors = 0
+        self._http_requests = 0
+        self._new_connections = 0
+        self._latencies: deque = deque(maxlen=latency_window)
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._deadline_exceeded = 0
+        self._fallbacks = 0
+
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            http_client=self.http_client,
+            max_retries=max_retries,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        # Async twin for the event-loop chat path; same limits, its own pool
+        self.async_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            event_hooks={"request": [self._on_async_request], "response": [self._on_async_response]},
+        )
+        self.async_client = openai.AsyncOpenAI(
+            api_key=api_key,
+            http_client=self.async_http_client,
+            max_retries=max_retries,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+
+    def _on_request(self, request: httpx.Request) -> None:
+        # httpcore reports connection setup through the trace extension; a request
+        # that got a response without a TCP connect reused a pooled connection
+        request.extensions["trace"] = self._trace
+
+    def _on_response(self, response: httpx.Response) -> None:
+        with self._lock:
+            self._http_requests += 1
+
+    def _trace(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self._new_connections += 1
+
+    async def _on_async_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._async_trace
+
+    async def _on_async_response(self, response: httpx.Response) -> None:
+        self._on_response(response)
+
+    async def _async_trace(self, event_name: str, info: dict) -> None:
+        self._trace(event_name, info)
+
+    def chat_completion(self, **kwargs):
+        """client.chat.completions.create with latency/error accounting.
+        For stream=True the recorded latency is the time to open the stream."""
+        started = time.perf_counter()
+        try:
+            return self.client.chat.completions.create(**kwargs)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._calls += 1
+                self._latencies.append(elapsed)
+
+    async def achat_completion(self, **kwargs):
+        """Async chat completion on the shared async pool, with the same accounting."""
+        started = time.perf_counter()
+        try:
+            return await self.async_client.chat.completions.create(**kwargs)
+        except asyncio.CancelledError:
+            # Losing hedge / deadline: not a completed call, keep it out of the latency window
+            started = None
+            raise
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            if started is not None:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self._calls += 1
+                    self._latencies.append(elapsed)
+
+    def hedge_delay(self, min_delay: float = 1.0, min_samples: int = 20) -> Optional[float]:
+        """p95 of recent call latency (at least min_delay), or None until enough samples exist."""
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return max(min_delay, latencies[int(round(0.95 * (len(latencies) - 1)))])
+
+    async def _ahedged(self, deadline: float, hedge_after: Optional[float], **kwargs):
+        """One logical call bounded by ``deadline`` seconds. If it has not answered after
+        ``hedge_after`` seconds a second identical request is raced against it."""
+        async def run():
+            first = asyncio.ensure_future(self.achat_completion(**kwargs))
+            tasks = {first}
+            if hedge_after is not None and hedge_after < deadline:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done:
+                    with self._lock:
+                        self._hedges += 1
+                    tasks.add(asyncio.ensure_future(self.achat_completion(**kwargs)))
+            try:
+                error: Optional[BaseException] = None
+                while tasks:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is not first:
+                                with self._lock:
+                                    self._hedge_wins += 1
+                            return task.result()
+                        error = task.exception()
+                raise error
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        try:
+            return await asyncio.wait_for(run(), timeout=deadline)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._deadline_exceeded += 1
+            raise
+
+    async def acomplete_with_fallback(
+        self,
+        models: List[str],
+        deadline: float,
+        hedge: bool = False,
+        hedge_min_delay: float = 1.0,
+        hedge_min_samples: int = 20,
+        **kwargs,
+    ) -> Tuple[str, object]:
+        """Try each model in turn, each attempt bounded by ``deadline`` seconds and optionally
+        hedged after the p95 latency. Returns (model, response); raises LLMUnavailableError
+        when the whole chain fails. Streams (stream=True) are never hedged."""
+        hedge_after = None
+        if hedge and not kwargs.get("stream"):
+            hedge_after = self.hedge_delay(hedge_min_delay, hedge_min_samples)
+        last_error: Optional[BaseException] = None
+        for i, model in enumerate(models):
+            if i > 0:
+                with self._lock:
+                    self._fallbacks += 1
+            try:
+                return model, await self._ahedged(deadline, hedge_after, model=model, **kwargs)
+            except Exception as e:
+                last_error = e
+                print(f"LLM call to {model} failed ({type(e).__name__}: {e}); trying next model")
+        raise LLMUnavailableError(str(last_error)) from last_error
+
+    def complete_with_fallback(self, models: List[str], deadline: float, **kwargs) -> Tuple[str, object]:
+        """Blocking counterpart of acomplete_with_fallback (no hedging). The deadline is
+        passed to the SDK as the request timeout, so it applies per attempt."""
+        last_error: Optional[BaseException] = None
+        for i, model in enumerate(models):
+            if i > 0:
+                with self._lock:
+                    self._fallbacks += 1
+            try:
+                return model, self.chat_completion(model=model, timeout=deadline, **kwargs)
+            except Exception as e:
+                last_error = e
+                print(f"LLM call to {model} failed ({type(e).__name__}: {e}); trying next model")
+        raise LLMUnavailableError(str(last_error)) from last_error
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            http_requests = self._http_requests
+            new_connections = self._new_connections
+            calls = self._calls
+            errors = self._errors
+            resilience = {
+                "hedged_requests": self._hedges,
+                "hedge_wins": self._hedge_wins,
+                "deadline_exceeded": self._deadline_exceeded,
+                "fallbacks": self._fallbacks,
+            }
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            idx = min(len(latencies) - 1, int(round(p * (len(latencies) - 1))))
+            return round(latencies[idx] * 1000.0, 1)
+
+        reused = max(0, http_requests - new_connections)
+        return {
+            "calls": calls,
+            "errors": errors,
+            "http_requests": http_requests,
+            "new_connections": new_connections,
+            "reused_connections": reused,
+            "connection_reuse_rate": round(reused / http_requests, 4) if http_requests else 0.0,
+            "latency_ms": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1] * 1000.0, 1) if latencies else None,
+                "samples": len(latencies),
+            },
+            **resilience,
+        }
+
+    def close(self) -> None:
+        self.http_client.close()
+
+    async def aclose(self) -> None:
+        await self.async_http_client.aclose()
@@ -0,0 +1,95 @@
+import re
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+SHORT_ACKS = frozenset({
+    "yes", "yeah", "yup", "y", "no", "nope", "n", "ok", "okay", "sure", "fine", "thanks", "thank you",
+})
+GREETINGS = frozenset({
+    "hi", "hello", "hey", "hey there", "hi there", "good morning", "good afternoon", "good evening",
+    "bye", "goodbye", "thanks a lot", "thank you so much", "great", "cool", "perfect", "got it",
+})
+COMPLEX_HINTS = re.compile(
+    r"\b(compare|comparison|difference|differences|versus|vs|explain|why|pros|cons|steps|step by step|"
+    r"recommend|which (one|is better)|troubleshoot|calculate|plan)\b"
+)
+TRIVIAL_RE = re.compile(r"[^a-z ]+")
+
+ROUTE_TRIVIAL = "trivial"
+ROUTE_FAQ_EXACT = "faq_exact"
+ROUTE_COMPLEX = "complex"
+
+
+def normalize_turn(query: str) -> str:
+    return " ".join(TRIVIAL_RE.sub(" ", (query or "").lower()).split())
+
+
+def is_short_ack(query: str) -> bool:
+    q = normalize_turn(query)
+    return q in SHORT_ACKS or q in GREETINGS
+
+
+class ModelRouter:
+    """Picks the completion model per turn with cheap local heuristics.
+
+    - trivial: acknowledgements and greetings ("thanks", "ok", "hi")
+    - faq_exact: the best retrieval hit is an FAQ whose question matches the query
+    - complex: everything else, served by the configured model
+
+    Trivial and FAQ-exact turns go to ``fast_model``. Decisions and per-route
+    completion latency are kept for the admin metrics endpoint.
+    """
+
+    def __init__(self, fast_model: str = "gpt-4o-mini", faq_max_distance: float = 0.05, enabled: bool = True, latency_window: int = 500):
+        self.fast_model = fast_model
+        self.faq_max_distance = faq_max_distance
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counts: dict = {}
+        self._latencies: dict = {}
+        self._latency_window = latency_window
+
+    def classify(self, query: str, faq_results: Optional[List[Tuple[str, float, dict]]] = None) -> str:
+        q = normalize_turn(query)
+        if not q or is_short_ack(q):
+            return ROUTE_TRIVIAL
+        if faq_results and faq_results[0][1] <= self.faq_max_distance and not COMPLEX_HINTS.search(q):
+            return ROUTE_FAQ_EXACT
+        return ROUTE_COMPLEX
+
+    def route(self, query: str, configured_model: str, faq_results: Optional[List[Tuple[str, float, dict]]] = None) -> Tuple[str, str]:
+        """Return (route, model) for a turn."""
+        route = self.classify(query, faq_results)
+        if not self.enabled or route == ROUTE_COMPLEX:
+            return route, configured_model
+        return route, self.fast_model
+
+    def record(self, route: str, model: str, latency: float) -> None:
+        with self._lock:
+            key = (route, model)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._latencies.setdefault(route, deque(maxlen=self._latency_window)).append(latency)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = {route: sorted(values) for route, values in self._latencies.items()}
+
+        def percentile(values: list, p: float) -> Optional[float]:
+            if not values:
+                return None
+            return round(values[min(len(values) - 1, int(round(p * (len(values) - 1))))] * 1000.0, 1)
+
+        routes: dict = {}
+        for (route, model), count in counts.items():
+            entry = routes.setdefault(route, {"calls": 0, "models": {}})
+            entry["calls"] += count
+            entry["models"][model] = count
+        for route, values in latencies.items():
+            routes.setdefault(route, {"calls": 0, "models": {}})["latency_ms"] = {
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "samples": len(values),
+            }
+        return {"enabled": self.enabled, "fast_model": self.fast_model, "routes": routes}
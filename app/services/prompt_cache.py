@@ -0,0 +1,88 @@
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+DEFAULT_MESSAGING_CONFIG = {
+    'ai_model': 'gpt-4o',
+    'conversational': True,
+    'strict_faq': True,
+    'response_length': 'Medium',
+    'welcome_message': 'Hey there, how can I help you?',
+    'server_error_message': 'Apologies, there seems to be a server error.'
+}
+
+RESPONSE_LENGTH_MAX_TOKENS = {'Short': 300, 'Medium': 500, 'Long': 800}
+
+
+def build_behavior_instructions(messaging_config: dict) -> List[str]:
+    """Behaviour instructions derived from the messaging settings."""
+    instructions = []
+    if messaging_config.get('strict_faq', False):
+        instructions.append(
+            "STRICT MODE: Only answer using information from the Knowledge Base provided. "
+            "If the topic is not covered in the knowledge base, redirect the user to the contact page."
+        )
+    if not messaging_config.get('conversational', True):
+        instructions.append("Keep responses professional and focused. Avoid casual chitchat.")
+    if messaging_config.get('suggest_followups', False):
+        instructions.append(
+            "After answering, suggest 1-2 brief follow-up questions the user might find helpful, "
+            "formatted naturally (e.g. 'You might also want to know: ...')."
+        )
+    return instructions
+
+
+class PromptAssembly:
+    """The static part of every chat prompt, built once per system prompt / messaging config.
+
+    ``static_prefix`` (system prompt + behaviour instructions) always opens the
+    system message, byte-identical across requests, so provider-side prompt
+    caching can reuse it; retrieved context and per-turn overrides follow it.
+    """
+
+    def __init__(self, system_prompt: str, messaging_config: Optional[dict], token_len: Callable[[str], int]):
+        self.system_prompt = system_prompt
+        self.messaging_config = dict(messaging_config) if messaging_config is not None else dict(DEFAULT_MESSAGING_CONFIG)
+        self.behavior_instructions = build_behavior_instructions(self.messaging_config)
+        self.static_prefix = system_prompt
+        if self.behavior_instructions:
+            self.static_prefix += "\n\n" + "\n".join(self.behavior_instructions)
+        self.static_prefix_tokens = token_len(self.static_prefix)
+        self.max_tokens = RESPONSE_LENGTH_MAX_TOKENS.get(self.messaging_config.get('response_length', 'Medium'), 500)
+
+
+class PromptCache:
+    """Process-wide cache of the current PromptAssembly.
+
+    ``load(db)`` returns (system_prompt, messaging_config) and runs only after
+    invalidate(), which the system prompt and messaging config endpoints call.
+    """
+
+    def __init__(self, load: Callable[[Session], Tuple[str, dict]], token_len: Callable[[str], int]):
+        self.load = load
+        self.token_len = token_len
+        self.builds = 0
+        self._lock = threading.Lock()
+        self._assembly: Optional[PromptAssembly] = None
+        self._generation = 0
+
+    def get(self, db: Session) -> PromptAssembly:
+        assembly = self._assembly
+        if assembly is not None:
+            return assembly
+        with self._lock:
+            generation = self._generation
+        system_prompt, messaging_config = self.load(db)
+        assembly = PromptAssembly(system_prompt, messaging_config, self.token_len)
+        with self._lock:
+            # Don't keep a build that raced with an invalidation
+            if generation == self._generation:
+                self._assembly = assembly
+                self.builds += 1
+        return assembly
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._assembly = None
@@ -1,16 +1,18 @@
 import os
-import re
+import threading
+import time
 import uuid
-from typing import List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterator, List, Optional, Tuple, Union
 from pathlib import Path
 
 import chromadb
 from chromadb.config import Settings
-import openai
-from sentence_transformers import SentenceTransformer
+from sqlalchemy import update
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import PyPDF2
-from docx import Document
 try:
     import tiktoken  # optional; may require network on first use
 except Exception:  # pragma: no cover
@@ -18,6 +20,24 @@ except Exception:  # pragma: no cover
 
 from models import KnowledgeDocument, DocumentChunk, FAQ
 from config import settings
+from services.embedding_backends import create_embedding_backend
+from services.embedding_batcher import EmbeddingBatcher
+from services.embedding_cache import EmbeddingCache
+from services.faq_index import FAQIndex, tokenize as faq_tokenize
+from services.llm_client import LLMClient, LLMUnavailableError
+from services.model_router import SHORT_ACKS, ModelRouter
+from services.prompt_cache import DEFAULT_MESSAGING_CONFIG, PromptAssembly
+from services.response_cache import ResponseCache
+from utils.context_builder import model_context_window, pack_context
+from utils.chunker import chunk_text as chunk_text_by_tokens, content_hash, iter_chunks, iter_sentences, word_token_len
+from utils.text_extraction import iter_document_text
+from utils.token_counter import MESSAGE_OVERHEAD_TOKENS
+
+# Where a chat reply came from; surfaced as run_id and counted in response_source_stats()
+SOURCE_LLM = "rag-response"
+SOURCE_RESPONSE_CACHE = "response-cache"
+SOURCE_FAQ_DIRECT = "faq-direct"
+SOURCE_SERVER_ERROR = "server-error"
 
 class RAGService:
     def __init__(self):
@@ -32,9 +52,83 @@ class RAGService:
             name="knowledge_base",
             metadata={"hnsw:space": "cosine"}
         )
+        # FAQ questions, embedded with the same model so one query embedding serves both lookups
+        self.faq_collection = self.chroma_client.get_or_create_collection(
+            name="faqs",
+            metadata={"hnsw:space": "cosine"}
+        )
         
         
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # An explicitly chosen backend that cannot load is a deployment error, not
+        # something to paper over with the torch model
+        try:
+            self.embedding_model = create_embedding_backend(
+                settings.EMBEDDING_BACKEND,
+                settings.EMBEDDING_MODEL_NAME,
+                settings.EMBEDDING_ONNX_MODEL_DIR,
+            )
+        except ImportError as e:
+            raise RuntimeError(
+                f"EMBEDDING_BACKEND={settings.EMBEDDING_BACKEND!r} needs packages that are not installed ({e}); "
+                "install requirements-embeddings.txt or set EMBEDDING_BACKEND=sentence-transformers"
+            ) from e
+        # Cache key namespace: differs per backend so vectors are never mixed
+        self.embedding_model_name = self.embedding_model.name
+        # Query encodings from concurrent requests are coalesced into one forward pass
+        self.query_batcher = None
+        if settings.EMBEDDING_QUERY_BATCHING:
+            self.query_batcher = EmbeddingBatcher(
+                lambda texts: self.embedding_model.encode(texts, batch_size=len(texts)).tolist(),
+                max_batch_size=settings.EMBEDDING_QUERY_MAX_BATCH,
+                max_wait_ms=settings.EMBEDDING_QUERY_MAX_WAIT_MS,
+            )
+        # Shared, pooled OpenAI client (keep-alive, explicit timeouts and retries)
+        self.llm = LLMClient(
+            api_key=settings.OPENAI_API_KEY,
+            timeout=settings.OPENAI_TIMEOUT_SECONDS,
+            connect_timeout=settings.OPENAI_CONNECT_TIMEOUT_SECONDS,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        )
+        # Sends trivial and FAQ-exact turns to a cheaper model
+        self.router = ModelRouter(
+            fast_model=settings.MODEL_ROUTER_FAST_MODEL,
+            faq_max_distance=settings.MODEL_ROUTER_FAQ_MAX_DISTANCE,
+            enabled=settings.MODEL_ROUTING_ENABLED,
+        )
+        # Lexical FAQ index, built lazily from the DB and updated by the FAQ endpoints
+        self.faq_index = FAQIndex()
+        # Persistent embedding cache shared by ingestion and search
+        self.embedding_cache = None
+        if settings.EMBEDDING_CACHE_ENABLED:
+            try:
+                self.embedding_cache = EmbeddingCache(
+                    settings.EMBEDDING_CACHE_PATH,
+                    max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+                )
+            except Exception as e:
+                print(f"Embedding cache disabled: {e}")
+        # Vector collection sizes, refreshed on writes instead of counted on every query
+        self._kb_count: Optional[int] = None
+        self._faq_count: Optional[int] = None
+        # Independent retrieval lookups (embedding, FAQ vectors, KB vectors) run side by side
+        self.retrieval_pool = ThreadPoolExecutor(max_workers=settings.RETRIEVAL_MAX_WORKERS, thread_name_prefix="retrieval")
+        self.retrieval_timings: deque = deque(maxlen=500)
+        self._source_lock = threading.Lock()
+        self.response_sources: dict = {}
+        # Bumped whenever documents or FAQs change; part of the response cache namespace
+        self.kb_version = 0
+        self.response_cache = None
+        if settings.RESPONSE_CACHE_ENABLED:
+            self.response_cache = ResponseCache(
+                similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY,
+                max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+                prompt_cost_per_1k=settings.LLM_PROMPT_COST_PER_1K,
+                completion_cost_per_1k=settings.LLM_COMPLETION_COST_PER_1K,
+            )
+        self._last_prompt: Optional[PromptAssembly] = None
         # Optional tokenizer: fall back to word-count if unavailable or offline
         self.tokenizer = None
         if tiktoken is not None:
@@ -62,212 +156,468 @@ class RAGService:
         # Always return True - search KB for every query, no exceptions
         return True
     
-    def extract_text_from_file(self, file_path: str) -> str:
-        """Extract text from various file formats."""
-        file_extension = Path(file_path).suffix.lower()
-        
-        if file_extension == '.pdf':
-            return self._extract_from_pdf(file_path)
-        elif file_extension == '.docx':
-            return self._extract_from_docx(file_path)
-        elif file_extension == '.txt':
-            return self._extract_from_txt(file_path)
-        else:
-            raise ValueError(f"Unsupported file format: {file_extension}")
-    
-    def _extract_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF file."""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        return text
-    
-    def _extract_from_docx(self, file_path: str) -> str:
-        """Extract text from Word document."""
-        doc = Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    
-    def _extract_from_txt(self, file_path: str) -> str:
-        """Extract text from text file."""
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
-    
-    def chunk_text(self, text: str, max_tokens: int = 500) -> List[str]:
-        """Split text into chunks based on token count."""
-        sentences = re.split(r'[.!?]+', text)
-        chunks = []
-        current_chunk = ""
-        
-        def token_len(s: str) -> int:
-            if self.tokenizer is not None:
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, serving repeats from the persistent embedding cache."""
+        if not texts:
+            return []
+        cached: dict[str, List[float]] = {}
+        if self.embedding_cache is not None:
+            try:
+                cached = self.embedding_cache.get_many(self.embedding_model_name, texts)
+            except Exception as e:
+                print(f"Embedding cache lookup failed: {e}")
+        missing = list(dict.fromkeys(t for t in texts if t not in cached))
+        if missing:
+            vectors = self.embedding_model.encode(missing, batch_size=max(1, settings.EMBEDDING_BATCH_SIZE)).tolist()
+            fresh = list(zip(missing, vectors))
+            if self.embedding_cache is not None:
                 try:
-                    return len(self.tokenizer.encode(s))
-                except Exception:
-                    pass
-            # Fallback: approximate tokens by words
-            return max(1, len(s.split()))
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            test_chunk = current_chunk + " " + sentence if current_chunk else sentence
-            if token_len(test_chunk) > max_tokens:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = sentence
-                else:
-                    
-                    words = sentence.split()
-                    step = max(1, max_tokens // 4)
-                    for i in range(0, len(words), step): 
-                        chunk_words = words[i:i + step]
-                        chunks.append(" ".join(chunk_words))
-            else:
-                current_chunk = test_chunk
-        
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-        
-        return chunks
+                    self.embedding_cache.put_many(self.embedding_model_name, fresh)
+                except Exception as e:
+                    print(f"Embedding cache write failed: {e}")
+            cached.update(fresh)
+        return [cached[t] for t in texts]
     
-    def process_document(self, db: Session, file_path: str, filename: str) -> KnowledgeDocument:
-        """Process a document and store it in the knowledge base."""
-       
-        text_content = self.extract_text_from_file(file_path)
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a single search query: cache first, then the micro-batching scheduler."""
+        if self.query_batcher is None:
+            return self.embed_texts([query])[0]
+        if self.embedding_cache is not None:
+            try:
+                cached = self.embedding_cache.get_many(self.embedding_model_name, [query])
+                if query in cached:
+                    return cached[query]
+            except Exception as e:
+                print(f"Embedding cache lookup failed: {e}")
+        vector = self.query_batcher.encode(query)
+        if self.embedding_cache is not None:
+            try:
+                self.embedding_cache.put_many(self.embedding_model_name, [(query, vector)])
+            except Exception as e:
+                print(f"Embedding cache write failed: {e}")
+        return vector
+    
+    def extract_text_from_file(self, file_path: str) -> str:
+        """Extract the full text from various file formats (see iter_document_text for streaming)."""
+        return "".join(self.iter_document_text(file_path))
+    
+    def iter_document_text(self, file_path: str) -> Iterator[str]:
+        """Yield document text page by page / paragraph by paragraph as it is read."""
+        return iter_document_text(
+            file_path,
+            parallel_min_pages=settings.PDF_PARALLEL_MIN_PAGES,
+            max_workers=settings.PDF_EXTRACT_WORKERS,
+        )
+    
+    def _token_len(self, s: str) -> int:
+        if self.tokenizer is not None:
+            try:
+                return len(self.tokenizer.encode(s))
+            except Exception:
+                pass
+        # Fallback: approximate tokens by words
+        return word_token_len(s)
+    
+    def _truncate_tokens(self, s: str, max_tokens: int) -> str:
+        """Cut text to at most max_tokens tokens (words when no tokenizer is available)."""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is not None:
+            try:
+                ids = self.tokenizer.encode(s)
+                return s if len(ids) <= max_tokens else self.tokenizer.decode(ids[:max_tokens]) + "..."
+            except Exception:
+                pass
+        words = s.split()
+        return s if len(words) <= max_tokens else " ".join(words[:max_tokens]) + "..."
+    
+    def as_prompt(self, system_prompt: Union[str, PromptAssembly], messaging_config: dict | None = None) -> PromptAssembly:
+        """Callers normally pass the cached PromptAssembly; a raw system prompt string is
+        assembled here, reusing the last assembly while prompt and config are unchanged."""
+        if isinstance(system_prompt, PromptAssembly):
+            return system_prompt
+        last = self._last_prompt
+        if last is not None and last.system_prompt == system_prompt and last.messaging_config == (messaging_config if messaging_config is not None else DEFAULT_MESSAGING_CONFIG):
+            return last
+        assembly = PromptAssembly(system_prompt, messaging_config, self._token_len)
+        self._last_prompt = assembly
+        return assembly
+    
+    def context_token_budget(self, model: str, max_tokens: int, fixed_prompt_tokens: int) -> int:
+        """Tokens available for retrieved snippets: the model window minus the completion,
+        the fixed prompt parts and a safety margin, capped at RAG_CONTEXT_MAX_TOKENS."""
+        available = model_context_window(model) - max_tokens - fixed_prompt_tokens - settings.RAG_CONTEXT_SAFETY_TOKENS
+        return max(0, min(available, settings.RAG_CONTEXT_MAX_TOKENS))
+    
+    def chunk_text(self, text: str, max_tokens: int | None = None, overlap_tokens: int | None = None) -> List[str]:
+        """Split text into chunks based on token count (linear time, optional token overlap)."""
+        return chunk_text_by_tokens(
+            text,
+            max_tokens=max_tokens if max_tokens is not None else settings.CHUNK_MAX_TOKENS,
+            overlap_tokens=overlap_tokens if overlap_tokens is not None else settings.CHUNK_OVERLAP_TOKENS,
+            token_len=self._token_len,
+        )
+    
+    def process_document(self, db: Session, file_path: str, filename: str, progress: Optional[Callable[[str, int, int], None]] = None) -> KnowledgeDocument:
+        """Process a document and store it in the knowledge base.
+        Extraction, chunking and embedding are streamed, so memory stays flat regardless of document size.
+        Re-uploading a file with the same filename updates that document in place: chunks are keyed by
+        content hash, unchanged chunks keep their vectors, only new chunks are embedded and stale ones are deleted.
+        The document's previous upload file is deleted once the new one has been ingested.
+        progress, if given, is called as progress(stage, chunks_processed, total_chunks); total is 0 until known.
+        """
+        def report(stage: str, processed: int = 0, total: int = 0) -> None:
+            if progress is not None:
+                progress(stage, processed, total)
+
+        report("extracting")
+        blocks = self.iter_document_text(file_path)
         
-   
-        doc = KnowledgeDocument(
-            filename=filename,
-            file_path=file_path,
-            document_type=Path(file_path).suffix.lower()[1:],  
-            processed=False,
-            chunk_count=0
+        doc = (
+            db.query(KnowledgeDocument)
+            .filter(KnowledgeDocument.filename == filename)
+            .order_by(KnowledgeDocument.id.desc())
+            .first()
         )
-        db.add(doc)
+        # An existing document keeps pointing at its previous file until the new one is ingested
+        replaced_path = None
+        if doc:
+            if doc.file_path != file_path:
+                replaced_path = doc.file_path
+        else:
+            doc = KnowledgeDocument(
+                filename=filename,
+                file_path=file_path,
+                document_type=Path(file_path).suffix.lower()[1:],  
+                processed=False,
+                chunk_count=0
+            )
+            db.add(doc)
         db.commit()
         db.refresh(doc)
         
-       
-        chunks = self.chunk_text(text_content)
+        # Existing chunks by content hash: hash -> [(chunk_id, vector_id, chunk_index)]
+        existing_by_hash: dict[str, list[tuple[int, str, int]]] = {}
+        rows = (
+            db.query(DocumentChunk.id, DocumentChunk.vector_id, DocumentChunk.chunk_index, DocumentChunk.content_hash)
+            .filter(DocumentChunk.document_id == doc.id, DocumentChunk.content_hash.isnot(None))
+            .all()
+        )
+        for chunk_id, vector_id, chunk_index, chunk_hash in rows:
+            existing_by_hash.setdefault(chunk_hash, []).append((chunk_id, vector_id, chunk_index))
+        del rows
+        # Chunks stored before hashing was introduced are hashed on the fly; only these
+        # need their text, streamed so the old document is never held in memory at once
+        legacy_rows = (
+            db.query(DocumentChunk.id, DocumentChunk.vector_id, DocumentChunk.chunk_index, DocumentChunk.chunk_text)
+            .filter(DocumentChunk.document_id == doc.id, DocumentChunk.content_hash.is_(None))
+            .yield_per(500)
+        )
+        for chunk_id, vector_id, chunk_index, text in legacy_rows:
+            existing_by_hash.setdefault(content_hash(text), []).append((chunk_id, vector_id, chunk_index))
         
-       
-        chunk_ids = []
-        for i, chunk_text in enumerate(chunks):
-           
-            embedding = self.embedding_model.encode(chunk_text).tolist()
-            
+        chunks = iter_chunks(
+            iter_sentences(blocks),
+            max_tokens=settings.CHUNK_MAX_TOKENS,
+            overlap_tokens=settings.CHUNK_OVERLAP_TOKENS,
+            token_len=self._token_len,
+        )
         
-            vector_id = f"{doc.id}_{i}_{uuid.uuid4().hex[:8]}"
-           
-            self.collection.add(
-                embeddings=[embedding],
-                documents=[chunk_text],
-                metadatas=[{
-                    "document_id": doc.id,
-                    "filename": filename,
-                    "chunk_index": i
-                }],
-                ids=[vector_id]
-            )
+        # Embed and store in batches as chunks come off the extractor: one forward
+        # pass, one Chroma add and one DB flush per batch instead of per chunk
+        batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+        started = time.perf_counter()
+        processed = 0
+        embedded = 0
+        reused = 0
+        while True:
+            batch = list(islice(chunks, batch_size))
+            if not batch:
+                break
+            start = processed
             
-           
-            chunk = DocumentChunk(
-                document_id=doc.id,
-                chunk_text=chunk_text,
-                chunk_index=i,
-                vector_id=vector_id
-            )
-            db.add(chunk)
-            chunk_ids.append(vector_id)
+            new_chunks: list[tuple[int, str, str]] = []  # (chunk_index, text, hash)
+            moved: list[dict] = []
+            for j, text in enumerate(batch):
+                idx = start + j
+                h = content_hash(text)
+                bucket = existing_by_hash.get(h)
+                if bucket:
+                    chunk_id, vector_id, old_index = bucket.pop()
+                    if not bucket:
+                        del existing_by_hash[h]
+                    reused += 1
+                    if old_index != idx:
+                        moved.append({"id": chunk_id, "vector_id": vector_id, "chunk_index": idx, "content_hash": h})
+                else:
+                    new_chunks.append((idx, text, h))
+            
+            if moved:
+                # Unchanged content at a new position: keep the vector, fix the index only
+                self.collection.update(
+                    ids=[m["vector_id"] for m in moved],
+                    metadatas=[{"document_id": doc.id, "filename": filename, "chunk_index": m["chunk_index"]} for m in moved],
+                )
+                db.execute(
+                    update(DocumentChunk),
+                    [{"id": m["id"], "chunk_index": m["chunk_index"], "content_hash": m["content_hash"]} for m in moved],
+                )
+            
+            if new_chunks:
+                texts = [text for _, text, _ in new_chunks]
+                embeddings = self.embed_texts(texts)
+                
+                vector_ids = [f"{doc.id}_{idx}_{uuid.uuid4().hex[:8]}" for idx, _, _ in new_chunks]
+                self.collection.add(
+                    embeddings=embeddings,
+                    documents=texts,
+                    metadatas=[
+                        {
+                            "document_id": doc.id,
+                            "filename": filename,
+                            "chunk_index": idx
+                        }
+                        for idx, _, _ in new_chunks
+                    ],
+                    ids=vector_ids
+                )
+                
+                db.add_all([
+                    DocumentChunk(
+                        document_id=doc.id,
+                        chunk_text=text,
+                        chunk_index=idx,
+                        vector_id=vector_ids[j],
+                        content_hash=h
+                    )
+                    for j, (idx, text, h) in enumerate(new_chunks)
+                ])
+                embedded += len(new_chunks)
+            db.flush()
+            processed += len(batch)
+            report("embedding", processed, 0)
+        
+        # Whatever was not matched by content is stale
+        stale = [entry for bucket in existing_by_hash.values() for entry in bucket]
+        if stale:
+            self.collection.delete(ids=[vector_id for _, vector_id, _ in stale])
+            db.query(DocumentChunk).filter(DocumentChunk.id.in_([chunk_id for chunk_id, _, _ in stale])).delete(synchronize_session=False)
         
+        elapsed = time.perf_counter() - started
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        print(
+            f"Ingested {processed} chunks from {filename} in {elapsed:.2f}s ({rate:.1f} chunks/sec, batch_size={batch_size}); "
+            f"embedded {embedded}, reused {reused}, deleted {len(stale)} stale"
+        )
+        report("embedding", processed, processed)
        
+        doc.file_path = file_path
+        doc.document_type = Path(file_path).suffix.lower()[1:]
         doc.processed = True
-        doc.chunk_count = len(chunks)
+        doc.chunk_count = processed
         db.commit()
+        self.refresh_collection_counts()
+        self.invalidate_response_cache()
+        if replaced_path:
+            try:
+                Path(replaced_path).unlink(missing_ok=True)
+            except OSError as e:
+                print(f"Error deleting replaced upload {replaced_path}: {e}")
         
         return doc
     
-    def search_faqs(self, db: Session, query: str) -> List[Tuple[str, float, dict]]:
-        """Search FAQs for relevant information - NO RESTRICTIONS, return ALL FAQs."""
-        query_lower = query.lower()
+    @property
+    def kb_count(self) -> int:
+        if self._kb_count is None:
+            self._kb_count = self.collection.count()
+        return self._kb_count
+    
+    @property
+    def faq_count(self) -> int:
+        if self._faq_count is None:
+            self._faq_count = self.faq_collection.count()
+        return self._faq_count
+    
+    def refresh_collection_counts(self) -> None:
+        """Re-read the vector collection sizes; called after every write to either collection."""
         try:
-            faqs = db.query(FAQ).all()
+            self._kb_count = self.collection.count()
+            self._faq_count = self.faq_collection.count()
         except Exception as e:
+            self._kb_count = self._faq_count = None
+            print(f"Error counting vector collections: {e}")
+    
+    def ensure_faq_index(self, db: Session) -> None:
+        """Build the in-memory FAQ index from the database on first use. No embedding
+        happens here; the FAQ vector collection is synced by sync_faq_vectors at startup."""
+        if self.faq_index.built:
+            return
+        rows = db.query(FAQ.id, FAQ.question, FAQ.answer).all()
+        self.faq_index.build(rows)
+        print(f"FAQ index built with {len(rows)} FAQs")
+    
+    def sync_faq_vectors(self, db: Session) -> None:
+        """Embed FAQs missing from the FAQ vector collection and drop vectors of deleted FAQs.
+        Slow for a large FAQ set, so it runs in a background thread at startup."""
+        rows = db.query(FAQ.id, FAQ.question, FAQ.answer).all()
+        if not self.faq_index.built:
+            self.faq_index.build(rows)
+            print(f"FAQ index built with {len(rows)} FAQs")
+        try:
+            stored = set(self.faq_collection.get(include=[])["ids"])
+            wanted = {self._faq_vector_id(faq_id) for faq_id, _, _ in rows}
+            stale = list(stored - wanted)
+            if stale:
+                self.faq_collection.delete(ids=stale)
+            missing = [row for row in rows if self._faq_vector_id(row[0]) not in stored]
+            if missing:
+                self._upsert_faq_vectors(missing)
+                print(f"Embedded {len(missing)} FAQs into the FAQ vector collection")
+        except Exception as e:
+            print(f"Error syncing FAQ vectors: {e}")
+        self.refresh_collection_counts()
+    
+    @staticmethod
+    def _faq_vector_id(faq_id: int) -> str:
+        return f"faq_{faq_id}"
+    
+    def _upsert_faq_vectors(self, faqs: List[Tuple[int, str, str]]) -> None:
+        batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+        for start in range(0, len(faqs), batch_size):
+            batch = faqs[start:start + batch_size]
+            self.faq_collection.upsert(
+                ids=[self._faq_vector_id(faq_id) for faq_id, _, _ in batch],
+                embeddings=self.embed_texts([question for _, question, _ in batch]),
+                documents=[f"Q: {question}\nA: {answer}" for _, question, answer in batch],
+                metadatas=[{"source": "faq", "faq_id": faq_id, "question": question} for faq_id, question, _ in batch],
+            )
+    
+    def upsert_faqs(self, faqs: List[Tuple[int, str, str]]) -> None:
+        """Add or refresh FAQs (id, question, answer) in the lexical index and the FAQ vector collection."""
+        for faq_id, question, answer in faqs:
+            self.faq_index.upsert(faq_id, question, answer)
+        self.invalidate_response_cache()
+        try:
+            self._upsert_faq_vectors(faqs)
+        except Exception as e:
+            print(f"Error embedding FAQs: {e}")
+        self.refresh_collection_counts()
+    
+    def remove_faq(self, faq_id: int) -> None:
+        self.faq_index.remove(faq_id)
+        self.invalidate_response_cache()
+        try:
+            self.faq_collection.delete(ids=[self._faq_vector_id(faq_id)])
+        except Exception as e:
+            print(f"Error deleting FAQ vector: {e}")
+        self.refresh_collection_counts()
+    
+    def search_faq_vectors(self, query_embedding: List[float], top_k: int = 5) -> List[Tuple[str, float, dict]]:
+        """Semantic FAQ lookup; only matches closer than FAQ_SEMANTIC_MAX_DISTANCE are returned."""
+        try:
+            count = self.faq_count
+            if count == 0:
+                return []
+            results = self.faq_collection.query(
+                query_embeddings=[query_embedding],
+                n_results=min(top_k, count),
+                include=["documents", "metadatas", "distances"]
+            )
+        except Exception as e:
+            print(f"Error searching FAQ vectors: {e}")
             return []
-        
-        # If no FAQs, return empty
-        if not faqs:
-            return []
-        
-        faq_results = []
-        for faq in faqs:
-            question_lower = faq.question.lower()
-            answer_lower = faq.answer.lower()
-            
-            # Calculate relevance score
-            score = 0
-            query_words = query_lower.split()
-            
-            # Exact question match gets highest score
-            if query_lower in question_lower:
-                score = 100
-            else:
-                # Check for word matches
-                for word in query_words:
-                    if len(word) > 2:
-                        if word in question_lower:
-                            score += 3
-                        if word in answer_lower:
-                            score += 1
-                
-                # Check for partial matches
-                for word in query_words:
-                    if len(word) > 3:
-                        if any(word in q_word for q_word in question_lower.split()):
-                            score += 2
-                        if any(word in a_word for a_word in answer_lower.split()):
-                            score += 1
-            
-            # Always include FAQ, distance determines ranking
-            if score >= 100:
-                distance = 0.0
-            else:
-                normalized_score = min(1.0, score / max(1, len(query_words) * 3)) if query_words else 0.5
-                distance = 1.0 - normalized_score
-            
-            faq_text = f"Q: {faq.question}\nA: {faq.answer}"
-            faq_results.append((
-                faq_text, 
-                distance, 
-                {"source": "faq", "faq_id": faq.id, "question": faq.question}
-            ))
-        
-        # Sort by distance (lower is better) - only return relevant FAQs
-        faq_results.sort(key=lambda x: x[1])
-        # Only return FAQs with at least some word match (distance < 0.95 means score > 0)
-        # Returning irrelevant FAQs pollutes the AI context and causes wrong responses
-        return [r for r in faq_results if r[1] < 0.95]
+        matches = []
+        if results.get('documents') and results['documents'][0]:
+            for doc_text, metadata, distance in zip(results['documents'][0], results['metadatas'][0], results['distances'][0]):
+                if distance < settings.FAQ_SEMANTIC_MAX_DISTANCE:
+                    matches.append((doc_text, distance, metadata))
+        return matches
+    
+    @staticmethod
+    def _merge_faq_results(lexical: List[Tuple[str, float, dict]], semantic: List[Tuple[str, float, dict]]) -> List[Tuple[str, float, dict]]:
+        """One entry per FAQ, keeping the closer of its lexical and semantic matches."""
+        best: dict = {r[2].get("faq_id"): r for r in lexical}
+        for r in semantic:
+            faq_id = r[2].get("faq_id")
+            if faq_id not in best or r[1] < best[faq_id][1]:
+                best[faq_id] = r
+        return sorted(best.values(), key=lambda r: r[1])
+    
+    def retrieve(self, db: Session, search_q: str, query_embedding: Optional[List[float]] = None) -> Tuple[List[Tuple[str, float, dict]], List[Tuple[str, float, dict]], dict]:
+        """
+        FAQ and KB retrieval with the independent lookups overlapped:
+        the query embedding is computed in the pool while the BM25 FAQ search runs here
+        (it needs the request's DB session), then the KB and FAQ vector searches run side by side.
+        Returns (faq_results, kb_results, timings_ms).
+        """
+        timings: dict = {}
+        started = time.perf_counter()
 
-    def search_knowledge_base(self, query: str, top_k: int = 10) -> List[Tuple[str, float, dict]]:
+        def timed(stage: str, fn, *args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings[stage] = round((time.perf_counter() - t0) * 1000.0, 2)
+
+        embed_future = None
+        if query_embedding is None:
+            embed_future = self.retrieval_pool.submit(timed, "embed", self.embed_query, search_q)
+        try:
+            timed("faq_index", self.ensure_faq_index, db)
+            lexical = timed("faq_lexical", self.faq_index.search, search_q, limit=20, max_distance=0.95)
+        except Exception as e:
+            print(f"Error searching FAQ index: {e}")
+            lexical = []
+        if embed_future is not None:
+            query_embedding = embed_future.result()
+        kb_future = self.retrieval_pool.submit(
+            timed, "kb_search", self.search_knowledge_base, search_q, top_k=5, query_embedding=query_embedding
+        )
+        semantic = timed("faq_vector", self.search_faq_vectors, query_embedding)
+        kb_results = kb_future.result()
+        faq_results = self._merge_faq_results(lexical, semantic)
+
+        timings["total"] = round((time.perf_counter() - started) * 1000.0, 2)
+        self.retrieval_timings.append(dict(timings))
+        print(f"Retrieval timings (ms): {timings}")
+        return faq_results, kb_results, timings
+    
+    def retrieval_stats(self) -> dict:
+        """p50/p95 per retrieval stage over the recent requests."""
+        samples = list(self.retrieval_timings)
+        stages: dict = {}
+        for sample in samples:
+            for stage, ms in sample.items():
+                stages.setdefault(stage, []).append(ms)
+
+        def percentile(values: list, p: float) -> float:
+            values = sorted(values)
+            return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+        return {
+            "samples": len(samples),
+            "stages_ms": {
+                stage: {"p50": percentile(values, 0.50), "p95": percentile(values, 0.95)}
+                for stage, values in stages.items()
+            },
+        }
+
+    def search_knowledge_base(self, query: str, top_k: int = 10, query_embedding: Optional[List[float]] = None) -> List[Tuple[str, float, dict]]:
         """
         Search the knowledge base for relevant information - NO RESTRICTIONS.
         Increased top_k to 10 to get results from multiple knowledge base files.
+        Pass query_embedding to reuse an embedding already computed for this query.
         """
         try:
             # Check if collection has any data
-            collection_count = self.collection.count()
+            collection_count = self.kb_count
             if collection_count == 0:
                 print("Knowledge base is empty - no documents in ChromaDB")
                 return []
             
-            query_embedding = self.embedding_model.encode(query).tolist()
+            if query_embedding is None:
+                query_embedding = self.embed_query(query)
             
             # Get more results to cover multiple knowledge base files
             # Use at least 10 results or all available if less
@@ -298,26 +648,168 @@ class RAGService:
             traceback.print_exc()
             return []
     
-    def generate_rag_response(self, query: str, system_prompt: str, db: Session, history: list[dict] | None = None, messaging_config: dict | None = None) -> Tuple[str, bool]:
+    def invalidate_response_cache(self) -> None:
+        """Call after documents, FAQs, the system prompt or the messaging config change."""
+        self.kb_version += 1
+        if self.response_cache is not None:
+            self.response_cache.clear()
+    
+    def _response_cache_key(self, query: str, prompt: PromptAssembly, history: list[dict] | None) -> Optional[Tuple[str, List[float]]]:
+        """(namespace, query embedding) when the turn is cacheable: a first message with no history."""
+        if self.response_cache is None or history:
+            return None
+        namespace = ResponseCache.namespace(prompt.static_prefix, prompt.messaging_config, self.kb_version)
+        return namespace, self.embed_query(query)
+    
+    def _store_response(self, cache_key: Optional[Tuple[str, List[float]]], reply: str, used_kb: bool, response) -> None:
+        if cache_key is None:
+            return
+        usage = getattr(response, "usage", None)
+        self.response_cache.store(
+            cache_key[0], cache_key[1], reply, used_kb,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        )
+    
+    def _count_source(self, source: str) -> None:
+        with self._source_lock:
+            self.response_sources[source] = self.response_sources.get(source, 0) + 1
+    
+    def response_source_stats(self) -> dict:
+        with self._source_lock:
+            counts = dict(self.response_sources)
+        total = sum(counts.values())
+        saved = total - counts.get(SOURCE_LLM, 0)
+        return {
+            "replies": total,
+            "by_source": counts,
+            "llm_calls_saved": saved,
+            "llm_calls_saved_rate": round(saved / total, 4) if total else 0.0,
+        }
+    
+    def direct_faq_answer(self, query: str, faq_results: List[Tuple[str, float, dict]], messaging_config: dict) -> Optional[str]:
+        """
+        The stored answer of the best FAQ, when strict_faq mode is on and the match is confident:
+        distance <= FAQ_DIRECT_ANSWER_MAX_DISTANCE and the query covers at least
+        FAQ_DIRECT_ANSWER_MIN_COVERAGE of the FAQ question's terms.
+        """
+        if not settings.FAQ_DIRECT_ANSWER_ENABLED or not messaging_config.get('strict_faq', False) or not faq_results:
+            return None
+        _, distance, metadata = faq_results[0]
+        if metadata.get("source") != "faq" or distance > settings.FAQ_DIRECT_ANSWER_MAX_DISTANCE:
+            return None
+        faq = self.faq_index.get(metadata.get("faq_id"))
+        if faq is None:
+            return None
+        question, answer = faq
+        question_terms = set(faq_tokenize(question))
+        if not question_terms:
+            return None
+        coverage = len(question_terms & set(faq_tokenize(query))) / len(question_terms)
+        if coverage < settings.FAQ_DIRECT_ANSWER_MIN_COVERAGE:
+            return None
+        try:
+            return settings.FAQ_DIRECT_ANSWER_TEMPLATE.format(answer=answer, question=question)
+        except (KeyError, IndexError, ValueError):
+            return answer
+    
+    def _model_chain(self, model: str) -> List[str]:
+        """The routed model followed by the configured fallbacks, without repeats."""
+        return list(dict.fromkeys([model, *settings.LLM_FALLBACK_MODELS]))
+    
+    def _server_error_reply(self, messaging_config: dict) -> Tuple[str, bool, str]:
+        self._count_source(SOURCE_SERVER_ERROR)
+        message = messaging_config.get('server_error_message') or DEFAULT_MESSAGING_CONFIG['server_error_message']
+        return message, False, SOURCE_SERVER_ERROR
+    
+    async def agenerate_rag_response(self, query: str, system_prompt: Union[str, PromptAssembly], db: Session, history: list[dict] | None = None, messaging_config: dict | None = None, history_tokens: Optional[int] = None) -> Tuple[str, bool, str]:
         """
         Generate a response based on messaging configuration. Use KB when relevant; otherwise regular chat.
-        Returns (response, used_kb)
+        Returns (response, used_kb, source) where source is SOURCE_LLM, SOURCE_RESPONSE_CACHE,
+        SOURCE_FAQ_DIRECT or SOURCE_SERVER_ERROR (every model in the fallback chain failed).
         System prompt takes ABSOLUTE PRIORITY over all other instructions.
+        First messages are served from the semantic response cache when a close enough question was answered before.
+        Retrieval (DB, embedding, Chroma) runs in the threadpool and the completion is awaited on the
+        async OpenAI client, bounded by LLM_DEADLINE_SECONDS per model and optionally hedged.
         """
-        # Default messaging config if not provided
-        if messaging_config is None:
-            messaging_config = {
-                'ai_model': 'gpt-4o',
-                'conversational': True,
-                'strict_faq': True,
-                'response_length': 'Medium',
-                'welcome_message': 'Hey there, how can I help you?',
-                'server_error_message': 'Apologies, there seems to be a server error.'
-            }
+        prompt = self.as_prompt(system_prompt, messaging_config)
+        cache_key = await run_in_threadpool(self._response_cache_key, query, prompt, history)
+        if cache_key is not None:
+            cached = self.response_cache.lookup(*cache_key)
+            if cached is not None:
+                self._count_source(SOURCE_RESPONSE_CACHE)
+                return cached[0], cached[1], SOURCE_RESPONSE_CACHE
+        request = await run_in_threadpool(
+            self.build_rag_request, query, prompt, db, history=history,
+            query_embedding=cache_key[1] if cache_key else None, history_tokens=history_tokens,
+        )
+        if request.get("direct_reply") is not None:
+            self._count_source(SOURCE_FAQ_DIRECT)
+            return request["direct_reply"], request["used_kb"], SOURCE_FAQ_DIRECT
+        started = time.perf_counter()
+        try:
+            model, response = await self.llm.acomplete_with_fallback(
+                self._model_chain(request["model"]),
+                settings.LLM_DEADLINE_SECONDS,
+                hedge=settings.LLM_HEDGE_ENABLED,
+                hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY_SECONDS,
+                hedge_min_samples=settings.LLM_HEDGE_MIN_SAMPLES,
+                temperature=0.3,
+                max_tokens=request["max_tokens"],
+                messages=request["messages"],
+            )
+        except LLMUnavailableError:
+            return self._server_error_reply(prompt.messaging_config)
+        self.router.record(request["route"], model, time.perf_counter() - started)
+        reply = response.choices[0].message.content
+        self._store_response(cache_key, reply, request["used_kb"], response)
+        self._count_source(SOURCE_LLM)
+        return reply, request["used_kb"], SOURCE_LLM
+    
+    async def astream_rag_response(self, query: str, system_prompt: Union[str, PromptAssembly], db: Session, history: list[dict] | None = None, messaging_config: dict | None = None, history_tokens: Optional[int] = None):
+        """
+        Async streaming variant. Returns (stream, used_kb, source); iterate with `async for` and
+        `await stream.close()` to stop generation. When no completion is opened (direct FAQ
+        answer, or every model failed to open a stream in time) stream is the reply string.
+        """
+        prompt = self.as_prompt(system_prompt, messaging_config)
+        request = await run_in_threadpool(self.build_rag_request, query, prompt, db, history=history, history_tokens=history_tokens)
+        if request.get("direct_reply") is not None:
+            self._count_source(SOURCE_FAQ_DIRECT)
+            return request["direct_reply"], request["used_kb"], SOURCE_FAQ_DIRECT
+        started = time.perf_counter()
+        try:
+            model, stream = await self.llm.acomplete_with_fallback(
+                self._model_chain(request["model"]),
+                settings.LLM_DEADLINE_SECONDS,
+                temperature=0.3,
+                max_tokens=request["max_tokens"],
+                messages=request["messages"],
+                stream=True,
+            )
+        except LLMUnavailableError:
+            return self._server_error_reply(prompt.messaging_config)
+        # For streams the recorded latency is time to open the stream
+        self.router.record(request["route"], model, time.perf_counter() - started)
+        self._count_source(SOURCE_LLM)
+        return stream, request["used_kb"], SOURCE_LLM
+    
+    def build_rag_request(self, query: str, system_prompt: Union[str, PromptAssembly], db: Session, history: list[dict] | None = None, messaging_config: dict | None = None, query_embedding: Optional[List[float]] = None, history_tokens: Optional[int] = None) -> dict:
+        """
+        Run retrieval and assemble the chat completion request.
+        query_embedding, if given, is the embedding of `query` itself and is reused when
+        the search query is not contextualized. history_tokens, if given, is the token count
+        of `history` (from the stored per-message counts) and spares re-tokenizing it.
+        Returns {"messages", "model", "route", "max_tokens", "used_kb"}, plus "direct_reply"
+        when a confident FAQ match makes the completion unnecessary.
+        """
+        # Static prefix (system prompt + behaviour instructions) and its token count are precomputed
+        prompt = self.as_prompt(system_prompt, messaging_config)
+        messaging_config = prompt.messaging_config
+        max_tokens = prompt.max_tokens
         def contextualize_query(q: str, hist: list[dict] | None) -> str:
             q_stripped = (q or "").strip().lower()
-            short_ack = {"yes", "yeah", "yup", "y", "no", "nope", "n", "ok", "okay", "sure", "fine", "thanks", "thank you"}
-            if len(q_stripped.split()) <= 3 or q_stripped in short_ack:
+            if len(q_stripped.split()) <= 3 or q_stripped in SHORT_ACKS:
                 if hist:
                     for m in reversed(hist):
                         if m.get("role") == "assistant":
@@ -330,45 +822,58 @@ class RAGService:
                                 )
             return q
 
-        # Extract and apply messaging settings
-        response_length = messaging_config.get('response_length', 'Medium')
-        max_tokens = {'Short': 300, 'Medium': 500, 'Long': 800}.get(response_length, 500)
-
-        strict_faq = messaging_config.get('strict_faq', False)
-        conversational = messaging_config.get('conversational', True)
-        suggest_followups = messaging_config.get('suggest_followups', False)
-
-        behavior_instructions = []
-        if strict_faq:
-            behavior_instructions.append(
-                "STRICT MODE: Only answer using information from the Knowledge Base provided. "
-                "If the topic is not covered in the knowledge base, redirect the user to the contact page."
-            )
-        if not conversational:
-            behavior_instructions.append("Keep responses professional and focused. Avoid casual chitchat.")
-        if suggest_followups:
-            behavior_instructions.append(
-                "After answering, suggest 1-2 brief follow-up questions the user might find helpful, "
-                "formatted naturally (e.g. 'You might also want to know: ...')."
-            )
-
         # Use contextualized query for KB/FAQ search only — send original query to OpenAI
         search_q = contextualize_query(query, history)
 
-        faq_results = self.search_faqs(db, search_q)
-        kb_results = self.search_knowledge_base(search_q, top_k=5)
+        # One query embedding serves both the FAQ and the KB vector lookups
+        if search_q != query:
+            query_embedding = None
+        faq_results, kb_results, _ = self.retrieve(db, search_q, query_embedding=query_embedding)
 
         all_results = faq_results + kb_results
         all_results.sort(key=lambda x: x[1])
-        # Cap total context to top 6 most relevant results for speed
-        all_results = all_results[:6]
+        all_results = all_results[:settings.RAG_CONTEXT_MAX_RESULTS]
+
+        # Confident exact FAQ match in strict mode: answer from the FAQ without a completion
+        direct_reply = self.direct_faq_answer(query, faq_results, messaging_config)
+        if direct_reply is not None:
+            print(f"Direct FAQ answer (faq_id={faq_results[0][2].get('faq_id')}), skipping LLM call")
+            return {
+                "messages": [],
+                "model": None,
+                "route": SOURCE_FAQ_DIRECT,
+                "max_tokens": max_tokens,
+                "used_kb": True,
+                "direct_reply": direct_reply,
+            }
 
-        client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+        route, model = self.router.route(query, messaging_config.get('ai_model', settings.OPENAI_MODEL), faq_results)
+        print(f"Model route: {route} -> {model}")
+
+        # Pack snippets into what the model window leaves after the fixed prompt parts
+        breakdown = {
+            "static_prefix": prompt.static_prefix_tokens,
+            "history": history_tokens if history_tokens is not None else sum(
+                self._token_len(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in history or []
+            ),
+            "query": self._token_len(query) + MESSAGE_OVERHEAD_TOKENS,
+        }
+        context_budget = self.context_token_budget(model, max_tokens, sum(breakdown.values()))
+        all_results, context_parts, packing = pack_context(
+            all_results,
+            context_budget,
+            self._token_len,
+            self._truncate_tokens,
+            min_snippet_tokens=settings.RAG_CONTEXT_MIN_SNIPPET_TOKENS,
+        )
+        breakdown["context"] = packing["used"]
+        print(
+            f"Prompt tokens for {model}: {breakdown} total={sum(breakdown.values())} max_tokens={max_tokens}; "
+            f"context budget={context_budget} kept={packing['kept']} truncated={packing['truncated']} dropped={packing['dropped']}"
+        )
 
         if not all_results:
-            final_prompt = system_prompt
-            if behavior_instructions:
-                final_prompt += "\n\n" + "\n".join(behavior_instructions)
+            final_prompt = prompt.static_prefix
             if history:
                 final_prompt += (
                     "\n\nCRITICAL OVERRIDE: You are mid-conversation — chat history is shown above. "
@@ -379,38 +884,24 @@ class RAGService:
             if history:
                 messages.extend(history)
             messages.append({"role": "user", "content": query})
-            response = client.chat.completions.create(
-                model=messaging_config.get('ai_model', settings.OPENAI_MODEL),
-                temperature=0.3,
-                max_tokens=max_tokens,
-                messages=messages,
-            )
-            return response.choices[0].message.content, False
-
-        context_parts: list[str] = []
-        unique_docs = set()
-        faq_count = 0
-        for doc_text, score, metadata in all_results:
-            if metadata.get('source') == 'faq':
-                faq_count += 1
-                context_parts.append(f"FAQ: {doc_text}")
-            else:
-                doc_id = metadata.get('document_id')
-                if doc_id:
-                    unique_docs.add(doc_id)
-                filename = metadata.get('filename', 'document')
-                context_parts.append(f"From {filename}: {doc_text}")
+            return {
+                "messages": messages,
+                "model": model,
+                "route": route,
+                "max_tokens": max_tokens,
+                "used_kb": False,
+            }
 
         context = "\n\n".join(context_parts)
 
+        # The static prefix comes first and unchanged so provider-side prompt caching applies;
+        # per-request context follows it
         rag_system_prompt = (
-            f"{system_prompt}\n\n"
+            f"{prompt.static_prefix}\n\n"
             f"===== KNOWLEDGE BASE =====\n"
             f"{context}\n"
             f"===== END KNOWLEDGE BASE =====\n"
         )
-        if behavior_instructions:
-            rag_system_prompt += "\n" + "\n".join(behavior_instructions)
 
         # If there is existing conversation history, explicitly prevent re-greeting.
         # The system prompt instructs the bot to greet on short messages, which causes
@@ -427,13 +918,13 @@ class RAGService:
             messages.extend(history)
         messages.append({"role": "user", "content": query})
 
-        response = client.chat.completions.create(
-            model=messaging_config.get('ai_model', settings.OPENAI_MODEL),
-            temperature=0.3,
-            max_tokens=max_tokens,
-            messages=messages,
-        )
-        return response.choices[0].message.content, True
+        return {
+            "messages": messages,
+            "model": model,
+            "route": route,
+            "max_tokens": max_tokens,
+            "used_kb": True,
+        }
     
     def delete_document(self, db: Session, document_id: int) -> bool:
         """Delete a document and its chunks from both DB and vector store."""
@@ -444,6 +935,7 @@ class RAGService:
         vector_ids = [chunk.vector_id for chunk in chunks]
         if vector_ids:
             self.collection.delete(ids=vector_ids)
+            self.refresh_collection_counts()
         
      
         for chunk in chunks:
@@ -454,6 +946,7 @@ class RAGService:
         if doc:
             db.delete(doc)
             db.commit()
+            self.invalidate_response_cache()
             return True
         
         return False
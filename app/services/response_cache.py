@@ -0,0 +1,116 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class ResponseCache:
+    """Semantic cache of generated replies for history-less first messages.
+
+    Entries are grouped by a namespace hashed from everything that shapes the
+    answer besides the question (system prompt, messaging config, KB version),
+    so a prompt/config/content change never serves a stale reply. Within a
+    namespace a lookup returns the reply whose query embedding is most similar,
+    provided the cosine similarity reaches ``similarity_threshold``. Embeddings
+    are L2-normalized, so similarity is a dot product. Entries expire after
+    ``ttl_seconds`` and the least recently used are evicted past ``max_entries``.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        max_entries: int = 1000,
+        ttl_seconds: float = 3600.0,
+        prompt_cost_per_1k: float = 0.0,
+        completion_cost_per_1k: float = 0.0,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.prompt_cost_per_1k = prompt_cost_per_1k
+        self.completion_cost_per_1k = completion_cost_per_1k
+        self._lock = threading.Lock()
+        # key -> (namespace, embedding, reply, used_kb, prompt_tokens, completion_tokens, created)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._saved_prompt_tokens = 0
+        self._saved_completion_tokens = 0
+
+    @staticmethod
+    def namespace(system_prompt: str, messaging_config: Optional[dict], kb_version: int) -> str:
+        config = json.dumps(messaging_config or {}, sort_keys=True, default=str)
+        raw = f"{kb_version}\0{config}\0{system_prompt}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, namespace: str, embedding: Sequence[float]) -> Optional[tuple[str, bool]]:
+        """Return (reply, used_kb) for the closest cached question, or None."""
+        query = np.asarray(embedding, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            best_key, best_sim = None, self.similarity_threshold
+            expired = []
+            for key, (ns, vector, _, _, _, _, created) in self._entries.items():
+                if now - created > self.ttl_seconds:
+                    expired.append(key)
+                    continue
+                if ns != namespace:
+                    continue
+                sim = float(np.dot(vector, query))
+                if sim >= best_sim:
+                    best_key, best_sim = key, sim
+            for key in expired:
+                del self._entries[key]
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            _, _, reply, used_kb, prompt_tokens, completion_tokens, _ = self._entries[best_key]
+            self.hits += 1
+            self._saved_prompt_tokens += prompt_tokens
+            self._saved_completion_tokens += completion_tokens
+            return reply, used_kb
+
+    def store(self, namespace: str, embedding: Sequence[float], reply: str, used_kb: bool, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        if not reply:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._entries[self._next_key] = (namespace, vector, reply, used_kb, prompt_tokens, completion_tokens, time.time())
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every entry (documents, FAQs, system prompt or messaging config changed)."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            cost_saved = (
+                self._saved_prompt_tokens / 1000.0 * self.prompt_cost_per_1k
+                + self._saved_completion_tokens / 1000.0 * self.completion_cost_per_1k
+            )
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "llm_calls_saved": self.hits,
+                "prompt_tokens_saved": self._saved_prompt_tokens,
+                "completion_tokens_saved": self._saved_completion_tokens,
+                "estimated_cost_saved_usd": round(cost_saved, 4),
+            }
@@ -0,0 +1,200 @@
+"""
+Token-aware text chunking for knowledge base ingestion.
+
+Each sentence is tokenized exactly once and chunk sizes are tracked with running
+token counts, so chunking is linear in the length of the document.
+"""
+import hashlib
+import re
+from collections import deque
+from typing import Callable, Iterable, Iterator, List
+
+SENTENCE_SPLIT_RE = re.compile(r'[.!?]+')
+MAX_CARRY_CHARS = 100_000  # cap on buffered text with no sentence terminator
+
+
+def word_token_len(s: str) -> int:
+    """Fallback token estimate when no tokenizer is available."""
+    return max(1, len(s.split()))
+
+
+def content_hash(text: str) -> str:
+    """Stable key for a chunk's content, used to skip re-embedding unchanged chunks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_SPLIT_RE.split(text) if s.strip()]
+
+
+def _split_long_sentence(sentence: str, max_tokens: int) -> List[str]:
+    # Same word-window fallback the original chunker used for oversized sentences
+    words = sentence.split()
+    step = max(1, max_tokens // 4)
+    return [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+
+
+def iter_sentences(blocks: Iterable[str], max_carry_chars: int = MAX_CARRY_CHARS) -> Iterator[str]:
+    """Yield sentences from a stream of text blocks (pages, paragraphs).
+
+    Blocks are treated as consecutive slices of one text. A sentence that runs
+    across a block boundary is carried over and yielded once its terminator
+    arrives; unterminated runs longer than max_carry_chars are cut at a space.
+    """
+    carry = ""
+    for block in blocks:
+        if not block:
+            continue
+        parts = SENTENCE_SPLIT_RE.split(carry + block)
+        carry = parts.pop()
+        for part in parts:
+            part = part.strip()
+            if part:
+                yield part
+        if len(carry) > max_carry_chars:
+            cut = carry.rfind(" ")
+            cut = cut if cut > 0 else len(carry)
+            yield carry[:cut].strip()
+            carry = carry[cut:]
+    carry = carry.strip()
+    if carry:
+        yield carry
+
+
+def iter_chunks(
+    sentences: Iterable[str],
+    max_tokens: int = 500,
+    overlap_tokens: int = 0,
+    token_len: Callable[[str], int] = word_token_len,
+) -> Iterator[str]:
+    """Greedily pack sentences into chunks of at most max_tokens tokens.
+
+    The last sentences of each chunk, up to overlap_tokens tokens, are repeated at
+    the start of the next chunk. Sentences longer than max_tokens are split into
+    word windows and emitted as their own chunks. Chunks are yielded as soon as
+    they are full, so callers can embed while the source is still being read.
+    """
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    current: deque = deque()  # (sentence, token_count)
+    current_tokens = 0
+    current_has_new = False  # chunk holds more than carried-over overlap
+
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        n = token_len(sentence)
+
+        if n > max_tokens:
+            if current_has_new:
+                yield " ".join(s for s, _ in current)
+            current.clear()
+            current_tokens = 0
+            current_has_new = False
+            yield from _split_long_sentence(sentence, max_tokens)
+            continue
+
+        if current_tokens + n > max_tokens:
+            if current_has_new:
+                yield " ".join(s for s, _ in current)
+            # Keep the tail of the chunk as overlap, dropping whatever would
+            # leave no room for this sentence
+            carried: deque = deque()
+            carried_tokens = 0
+            while current and carried_tokens + current[-1][1] <= overlap_tokens:
+                s, c = current.pop()
+                carried.appendleft((s, c))
+                carried_tokens += c
+            while carried and carried_tokens + n > max_tokens:
+                _, c = carried.popleft()
+                carried_tokens -= c
+            current = carried
+            current_tokens = carried_tokens
+            current_has_new = False
+
+        current.append((sentence, n))
+        current_tokens += n
+        current_has_new = True
+
+    if current_has_new:
+        yield " ".join(s for s, _ in current)
+
+
+def chunk_sentences(
+    sentences: Iterable[str],
+    max_tokens: int = 500,
+    overlap_tokens: int = 0,
+    token_len: Callable[[str], int] = word_token_len,
+) -> List[str]:
+    return list(iter_chunks(sentences, max_tokens, overlap_tokens, token_len))
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = 500,
+    overlap_tokens: int = 0,
+    token_len: Callable[[str], int] = word_token_len,
+) -> List[str]:
+    """Split text on sentence boundaries into token-bounded chunks."""
+    return chunk_sentences(split_sentences(text), max_tokens, overlap_tokens, token_len)
+
+
+def _legacy_chunk_text(text: str, max_tokens: int, token_len: Callable[[str], int]) -> List[str]:
+    """Previous quadratic implementation, kept only for the benchmark below."""
+    sentences = re.split(r'[.!?]+', text)
+    chunks = []
+    current_chunk = ""
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        test_chunk = current_chunk + " " + sentence if current_chunk else sentence
+        if token_len(test_chunk) > max_tokens:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+                current_chunk = sentence
+            else:
+                chunks.extend(_split_long_sentence(sentence, max_tokens))
+        else:
+            current_chunk = test_chunk
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+if __name__ == "__main__":
+    # Microbenchmark: python -m utils.chunker (from the app directory)
+    import random
+    import time
+
+    try:
+        import tiktoken
+        _enc = tiktoken.get_encoding("cl100k_base")
+        bench_len = lambda s: len(_enc.encode(s))
+        tokenizer_name = "tiktoken cl100k_base"
+    except Exception:
+        bench_len = word_token_len
+        tokenizer_name = "word-count fallback"
+
+    rng = random.Random(0)
+    vocab = ["service", "customer", "hearing", "device", "battery", "warranty", "appointment",
+             "the", "a", "to", "of", "and", "with", "for", "your", "our", "is", "can", "will"]
+    parts = []
+    size = 0
+    while size < 1_000_000:
+        sentence = " ".join(rng.choice(vocab) for _ in range(rng.randint(6, 30))).capitalize() + ". "
+        parts.append(sentence)
+        size += len(sentence)
+    text = "".join(parts)
+
+    print(f"Text: {len(text) / 1e6:.2f} MB, tokenizer: {tokenizer_name}")
+    t0 = time.perf_counter()
+    legacy = _legacy_chunk_text(text, 500, bench_len)
+    t1 = time.perf_counter()
+    linear = chunk_text(text, 500, 0, bench_len)
+    t2 = time.perf_counter()
+    overlapped = chunk_text(text, 500, 50, bench_len)
+    t3 = time.perf_counter()
+    print(f"legacy chunk_text:        {t1 - t0:8.3f}s  {len(legacy)} chunks")
+    print(f"linear chunk_text:        {t2 - t1:8.3f}s  {len(linear)} chunks  ({(t1 - t0) / max(t2 - t1, 1e-9):.1f}x)")
+    print(f"linear chunk_text (+50):  {t3 - t2:8.3f}s  {len(overlapped)} chunks")
@@ -0,0 +1,77 @@
+"""
+Token-budgeted assembly of retrieved FAQ / knowledge base snippets.
+
+Snippets are packed in relevance order (lowest distance first) into an explicit
+token budget. A snippet that does not fit whole is truncated if enough budget is
+left for it to be useful; everything after the budget is exhausted is dropped.
+"""
+from typing import Callable, List, Tuple
+
+# Context windows (prompt + completion tokens) for the models the admin UI offers
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-4.1": 1_047_576,
+    "gpt-4.1-mini": 1_047_576,
+    "gpt-4.1-nano": 1_047_576,
+    "gpt-4-32k": 32_768,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo-16k": 16_385,
+    "gpt-3.5-turbo": 16_385,
+}
+DEFAULT_CONTEXT_WINDOW = 8_192
+
+
+def model_context_window(model: str) -> int:
+    """Context window for a model name, matching dated variants by longest prefix."""
+    model = (model or "").lower()
+    for name in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_CONTEXT_WINDOWS[name]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def format_snippet(doc_text: str, metadata: dict) -> str:
+    if metadata.get("source") == "faq":
+        return f"FAQ: {doc_text}"
+    return f"From {metadata.get('filename', 'document')}: {doc_text}"
+
+
+def pack_context(
+    results: List[Tuple[str, float, dict]],
+    budget_tokens: int,
+    token_len: Callable[[str], int],
+    truncate: Callable[[str, int], str],
+    min_snippet_tokens: int = 50,
+    separator_tokens: int = 2,
+) -> Tuple[List[Tuple[str, float, dict]], List[str], dict]:
+    """
+    Pack (doc_text, distance, metadata) results into at most budget_tokens.
+    Returns (kept_results, context_parts, stats) where stats counts kept,
+    truncated and dropped snippets and the tokens used.
+    """
+    kept: List[Tuple[str, float, dict]] = []
+    parts: List[str] = []
+    used = 0
+    truncated = 0
+    for doc_text, distance, metadata in sorted(results, key=lambda r: r[1]):
+        remaining = budget_tokens - used - (separator_tokens if parts else 0)
+        if remaining < min_snippet_tokens:
+            break
+        part = format_snippet(doc_text, metadata)
+        tokens = token_len(part)
+        if tokens > remaining:
+            part = truncate(part, remaining)
+            tokens = token_len(part)
+            truncated += 1
+        used += tokens + (separator_tokens if parts else 0)
+        kept.append((doc_text, distance, metadata))
+        parts.append(part)
+    return kept, parts, {
+        "budget": budget_tokens,
+        "used": used,
+        "kept": len(kept),
+        "truncated": truncated,
+        "dropped": len(results) - len(kept),
+    }
@@ -0,0 +1,82 @@
+"""
+Streaming text extraction for knowledge base documents.
+
+Extractors yield text page by page (PDF), paragraph by paragraph (DOCX) or in
+fixed-size blocks (TXT), so ingestion can chunk and embed while the file is
+still being read. Large PDFs are split into page ranges and extracted in a
+process pool, with only a bounded number of ranges in flight at a time.
+"""
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List
+
+import PyPDF2
+from docx import Document
+
+TXT_BLOCK_SIZE = 64 * 1024
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Process-pool worker: extract pages [start, end) from a PDF."""
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        return [(reader.pages[i].extract_text() or "") + "\n" for i in range(start, end)]
+
+
+def iter_pdf_pages(
+    file_path: str,
+    parallel_min_pages: int = 50,
+    pages_per_task: int = 8,
+    max_workers: int = 2,
+) -> Iterator[str]:
+    """Yield PDF page text in page order."""
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        page_count = len(reader.pages)
+        if page_count < parallel_min_pages or max_workers <= 1:
+            for page in reader.pages:
+                yield (page.extract_text() or "") + "\n"
+            return
+
+    ranges = [(s, min(s + pages_per_task, page_count)) for s in range(0, page_count, pages_per_task)]
+    max_in_flight = max_workers * 2
+    # spawn rather than fork: the parent holds model and DB threads
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending: deque = deque()
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < max_in_flight:
+                start, end = ranges[next_range]
+                pending.append(pool.submit(_extract_pdf_page_range, file_path, start, end))
+                next_range += 1
+            yield from pending.popleft().result()
+
+
+def iter_docx_paragraphs(file_path: str) -> Iterator[str]:
+    doc = Document(file_path)
+    for paragraph in doc.paragraphs:
+        yield paragraph.text + "\n"
+
+
+def iter_txt_blocks(file_path: str, block_size: int = TXT_BLOCK_SIZE) -> Iterator[str]:
+    with open(file_path, 'r', encoding='utf-8') as file:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+def iter_document_text(file_path: str, parallel_min_pages: int = 50, max_workers: int = 2) -> Iterator[str]:
+    """Yield text blocks from a supported document as it is read."""
+    file_extension = Path(file_path).suffix.lower()
+    if file_extension == '.pdf':
+        return iter_pdf_pages(file_path, parallel_min_pages=parallel_min_pages, max_workers=max_workers)
+    elif file_extension == '.docx':
+        return iter_docx_paragraphs(file_path)
+    elif file_extension == '.txt':
+        return iter_txt_blocks(file_path)
+    else:
+        raise ValueError(f"Unsupported file format: {file_extension}")
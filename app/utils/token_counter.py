@@ -1,43 +1,153 @@
 """
 Token counting utilities with fallback for when tiktoken is unavailable
+
+Encodings are resolved once per model family and reused, counts of repeated
+strings (system prompt, recent messages) are kept in a small LRU memo, and lists
+of messages are encoded with a single tiktoken encode_batch call.
 """
+import threading
+from collections import OrderedDict
+
 try:
     import tiktoken
 except ImportError:
     tiktoken = None
 
+MESSAGE_OVERHEAD_TOKENS = 4  # base overhead per message for role/formatting
+CONVERSATION_OVERHEAD_TOKENS = 2
+
+_encodings: dict = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding_key(model: str) -> str:
+    # gpt-4* models use the gpt-4 encoding, everything else gpt-3.5-turbo's
+    return "gpt-4" if (model or "").startswith("gpt-4") else "gpt-3.5-turbo"
+
+
+def get_encoding(model: str = "gpt-3.5-turbo"):
+    """Encoding for a model, resolved once per model family; None when tiktoken is unavailable."""
+    key = _encoding_key(model)
+    if key in _encodings:
+        return _encodings[key]
+    with _encodings_lock:
+        if key not in _encodings:
+            encoding = None
+            if tiktoken is not None:
+                try:
+                    encoding = tiktoken.encoding_for_model(key)
+                except Exception:
+                    encoding = None
+            _encodings[key] = encoding
+    return _encodings[key]
+
+
+class TokenCountMemo:
+    """Thread-safe LRU memo of (encoding, text) -> token count."""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, text: str) -> int | None:
+        with self._lock:
+            count = self._data.get((key, text))
+            if count is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end((key, text))
+            self.hits += 1
+            return count
+
+    def put(self, key: str, text: str, count: int) -> None:
+        with self._lock:
+            self._data[(key, text)] = count
+            self._data.move_to_end((key, text))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+memo = TokenCountMemo()
+
+
+def _fallback_count(text: str) -> int:
+    # Fallback: rough estimation (1 token ≈ 0.75 words for English)
+    word_count = len(text.split())
+    return max(1, int(word_count / 0.75))
+
+
 def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
     """
     Count tokens in text. Falls back to word-based estimation if tiktoken unavailable.
     """
-    if tiktoken is not None:
+    text = text or ""
+    key = _encoding_key(model)
+    count = memo.get(key, text)
+    if count is not None:
+        return count
+    encoding = get_encoding(model)
+    count = None
+    if encoding is not None:
         try:
-            # Use the appropriate encoding for the model
-            if model.startswith("gpt-4"):
-                encoding = tiktoken.encoding_for_model("gpt-4")
-            else:
-                encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-            return len(encoding.encode(text))
+            count = len(encoding.encode(text))
         except Exception:
-            pass
-    
-    # Fallback: rough estimation (1 token ≈ 0.75 words for English)
-    word_count = len(text.split())
-    return max(1, int(word_count / 0.75))
+            count = None
+    if count is None:
+        count = _fallback_count(text)
+    memo.put(key, text, count)
+    return count
+
+
+def count_tokens_batch(texts: list[str], model: str = "gpt-3.5-turbo") -> list[int]:
+    """
+    Count tokens for many texts: memoized texts come from the memo, the rest are
+    encoded together with tiktoken's encode_batch.
+    """
+    key = _encoding_key(model)
+    texts = [t or "" for t in texts]
+    counts: list[int] = [0] * len(texts)
+    missing: dict[str, list[int]] = {}
+    for i, text in enumerate(texts):
+        count = memo.get(key, text)
+        if count is None:
+            missing.setdefault(text, []).append(i)
+        else:
+            counts[i] = count
+    if not missing:
+        return counts
+
+    unique = list(missing)
+    encoding = get_encoding(model)
+    fresh = None
+    if encoding is not None:
+        try:
+            fresh = [len(ids) for ids in encoding.encode_batch(unique)]
+        except Exception:
+            fresh = None
+    if fresh is None:
+        fresh = [_fallback_count(t) for t in unique]
+    for text, count in zip(unique, fresh):
+        memo.put(key, text, count)
+        for i in missing[text]:
+            counts[i] = count
+    return counts
+
 
 def count_messages_tokens(messages: list[dict], model: str = "gpt-3.5-turbo") -> int:
     """
     Count tokens for a list of OpenAI messages.
     Includes overhead for message formatting.
     """
-    total = 0
-    for message in messages:
-        # Each message has some overhead tokens for role/formatting
-        total += 4  # base overhead per message
-        total += count_tokens(message.get("content", ""), model)
-        
-    total += 2  # conversation overhead
-    return total
+    counts = count_tokens_batch([m.get("content", "") for m in messages], model)
+    return sum(counts) + MESSAGE_OVERHEAD_TOKENS * len(messages) + CONVERSATION_OVERHEAD_TOKENS
+
 
 def trim_history_to_token_budget(
     messages: list[dict],
@@ -61,10 +171,11 @@ def trim_history_to_token_budget(
     kept_system = system_msgs[:1]
     current_tokens = count_messages_tokens(kept_system, model) if kept_system else 0
 
-    # Pick from most recent to oldest within budget
+    # All message counts in one batch, then pick from most recent to oldest within budget
+    counts = count_tokens_batch([m.get("content", "") for m in non_system], model)
     picked_recent_first: list[dict] = []
-    for msg in reversed(non_system):
-        msg_tokens = count_tokens(msg.get("content", ""), model) + 4  # message overhead
+    for msg, tokens in zip(reversed(non_system), reversed(counts)):
+        msg_tokens = tokens + MESSAGE_OVERHEAD_TOKENS
         if current_tokens + msg_tokens <= max_tokens:
             picked_recent_first.append(msg)
             current_tokens += msg_tokens
@@ -74,3 +185,67 @@ def trim_history_to_token_budget(
     # Present in chronological order
     picked_chrono = list(reversed(picked_recent_first))
     return (kept_system + picked_chrono) if kept_system else picked_chrono
+
+
+def _legacy_count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Previous implementation (encoding looked up on every call), kept for the benchmark."""
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model("gpt-4" if model.startswith("gpt-4") else "gpt-3.5-turbo")
+            return len(encoding.encode(text))
+        except Exception:
+            pass
+    return _fallback_count(text)
+
+
+if __name__ == "__main__":
+    # Microbenchmark: python -m utils.token_counter (from the app directory)
+    import random
+    import time
+
+    rng = random.Random(0)
+    vocab = ["service", "customer", "hearing", "device", "battery", "warranty", "appointment",
+             "the", "a", "to", "of", "and", "with", "for", "your", "our", "is", "can", "will"]
+    history = [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": " ".join(rng.choice(vocab) for _ in range(rng.randint(5, 120))),
+        }
+        for i in range(500)
+    ]
+    system_prompt = {"role": "system", "content": " ".join(rng.choice(vocab) for _ in range(8000))}
+    model = "gpt-4o"
+    print(f"History: {len(history)} messages, tiktoken: {'yes' if get_encoding(model) is not None else 'no (word fallback)'}")
+
+    def legacy_trim(msgs: list[dict], budget: int) -> int:
+        total = sum(_legacy_count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in msgs[:1])
+        kept = 0
+        for m in reversed(msgs[1:]):
+            t = _legacy_count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS
+            if total + t > budget:
+                break
+            total += t
+            kept += 1
+        return kept
+
+    messages = [system_prompt] + history
+    t0 = time.perf_counter()
+    legacy_total = sum(_legacy_count_tokens(m["content"], model) for m in messages)
+    t1 = time.perf_counter()
+    memo.clear()
+    batch_total = sum(count_tokens_batch([m["content"] for m in messages], model))
+    t2 = time.perf_counter()
+    warm_total = sum(count_tokens_batch([m["content"] for m in messages], model))
+    t3 = time.perf_counter()
+    assert legacy_total == batch_total == warm_total, (legacy_total, batch_total, warm_total)
+    legacy_kept = legacy_trim(messages, 1_000_000)
+    t4 = time.perf_counter()
+    memo.clear()
+    kept = len(trim_history_to_token_budget(messages, 1_000_000, model)) - 1
+    t5 = time.perf_counter()
+    assert legacy_kept == kept
+    print(f"legacy per-message count:   {(t1 - t0) * 1000:8.2f} ms  ({legacy_total} tokens)")
+    print(f"encode_batch (cold memo):   {(t2 - t1) * 1000:8.2f} ms  ({(t1 - t0) / max(t2 - t1, 1e-9):.1f}x)")
+    print(f"encode_batch (warm memo):   {(t3 - t2) * 1000:8.2f} ms  ({(t1 - t0) / max(t3 - t2, 1e-9):.1f}x)")
+    print(f"legacy trim (500 msgs):     {(t4 - t3) * 1000:8.2f} ms")
+    print(f"batched trim (500 msgs):    {(t5 - t4) * 1000:8.2f} ms  ({(t4 - t3) / max(t5 - t4, 1e-9):.1f}x)")
@@ -2366,7 +2366,21 @@ function FilesSection(){
       const res = await fetch(`${API_BASE}/documents/upload`, { method:'POST', body: fd, headers: ADMIN_KEY ? { 'Authorization': `Bearer ${ADMIN_KEY}` } : undefined });
       const data = await res.json().catch(()=>({}));
       if(!res.ok){ setStatus(`Error: ${data.detail || res.statusText}`); }
-      else { setStatus(`Uploaded: ${data.filename} (${data.chunk_count} chunks)`); setFile(null); await fetchDocs(); }
+      else {
+        setFile(null);
+        // Ingestion runs in the background; poll the job until it finishes
+        let job = data;
+        while(job && (job.status === 'queued' || job.status === 'running')){
+          setStatus(`Processing ${job.filename}: ${job.stage} (${job.chunks_processed} chunks)`);
+          await new Promise(r=>setTimeout(r, 1500));
+          const jr = await fetch(`${API_BASE}/documents/jobs/${data.job_id}`, { cache:'no-store', headers: ADMIN_KEY ? { 'Authorization': `Bearer ${ADMIN_KEY}` } : undefined });
+          if(!jr.ok) break;
+          job = await jr.json();
+        }
+        if(job?.status === 'failed'){ setStatus(`Error: ${job.error || 'Processing failed'}`); }
+        else { setStatus(`Uploaded: ${job?.filename || data.filename} (${job?.total_chunks ?? 0} chunks)`); }
+        await fetchDocs();
+      }
     }catch(e:any){ setStatus(`Error: ${e?.message||'Upload failed'}`); }
     finally{ setBusy(false); }
   }
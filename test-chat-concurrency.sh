@@ -0,0 +1,91 @@
+#!/bin/bash
+
+# Chat Concurrency Test
+# Checks that concurrent /chat requests overlap inside a single worker
+# instead of queueing behind each other, and that the event loop stays
+# responsive (/health latency) while chats are in flight.
+#
+# Usage: ./test-chat-concurrency.sh [API_BASE] [CONCURRENCY]
+# Note: /chat is rate limited to 30/minute per client IP, keep CONCURRENCY below that.
+
+API_BASE="${1:-http://localhost:8000}"
+CONCURRENCY="${2:-10}"
+MESSAGE="What are your opening hours?"
+
+echo "================================="
+echo "Load Test: Concurrent Chat"
+echo "================================="
+echo ""
+echo "API Base:    $API_BASE"
+echo "Concurrency: $CONCURRENCY"
+echo ""
+
+chat_request() {
+    curl -s -o /dev/null -w "%{http_code}" \
+        -X POST "$API_BASE/chat" \
+        -H "Content-Type: application/json" \
+        -H "X-Client-Id: loadtest-$1" \
+        -d "{\"message\": \"$MESSAGE\"}"
+}
+
+echo "Single Chat Request (Baseline)..."
+echo "---------------------------------"
+
+START=$(date +%s%3N)
+STATUS=$(chat_request "baseline")
+END=$(date +%s%3N)
+
+SINGLE_TIME=$((END - START))
+echo "✓ /chat returned $STATUS in ${SINGLE_TIME}ms"
+echo ""
+
+echo "Concurrent Chat Requests..."
+echo "---------------------------"
+
+TMP_DIR=$(mktemp -d)
+START=$(date +%s%3N)
+for i in $(seq 1 "$CONCURRENCY"); do
+    chat_request "$i" > "$TMP_DIR/$i" &
+done
+
+# Probe the event loop while the chats are running
+sleep 0.2
+HEALTH_TIMES=()
+for i in 1 2 3 4 5; do
+    H_START=$(date +%s%3N)
+    curl -s "$API_BASE/health" > /dev/null
+    H_END=$(date +%s%3N)
+    HEALTH_TIMES+=($((H_END - H_START)))
+    sleep 0.2
+done
+
+wait
+END=$(date +%s%3N)
+
+CONCURRENT_TIME=$((END - START))
+OK=$(grep -l "^200$" "$TMP_DIR"/* | wc -l)
+rm -rf "$TMP_DIR"
+
+echo "✓ $OK/$CONCURRENCY chats returned 200"
+echo "Concurrent Total Time: ${CONCURRENT_TIME}ms"
+echo "/health latency under load: ${HEALTH_TIMES[*]} (ms)"
+echo ""
+
+echo "================================="
+echo "Results Summary"
+echo "================================="
+SERIAL_ESTIMATE=$((SINGLE_TIME * CONCURRENCY))
+echo "Single chat:          ${SINGLE_TIME}ms"
+echo "Serial estimate (x$CONCURRENCY): ${SERIAL_ESTIMATE}ms"
+echo "Concurrent ($CONCURRENCY):       ${CONCURRENT_TIME}ms"
+
+if [ $CONCURRENT_TIME -gt 0 ]; then
+    SPEEDUP=$((SERIAL_ESTIMATE * 100 / CONCURRENT_TIME))
+    echo "Effective concurrency: $((SPEEDUP / 100)).$((SPEEDUP % 100 / 10))x"
+fi
+
+if [ $CONCURRENT_TIME -lt $((SINGLE_TIME * 3)) ]; then
+    echo "Chats overlap within the worker 🚀"
+else
+    echo "Note: chats look serialized; check for blocking calls on the event loop"
+fi